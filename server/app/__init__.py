@@ -1,53 +1,39 @@
 import os
-import chromadb
-from typing import List
 from flask import Flask
-from .extensions import mongo
+from .extensions import mongo, job_queue, chroma, completion_cache
 from .routes import register_routes
+from .utils.uploads import UploadRequest
 from flask_cors import CORS
-from chromadb.config import Settings
-from langchain_huggingface import HuggingFaceEmbeddings
-from sentence_transformers import SentenceTransformer
-
-USE_MINI_MODEL = True 
-
-if USE_MINI_MODEL:
-    model_id = "sentence-transformers/all-MiniLM-L6-v2"
-    model_path = "./local_models/all-MiniLM-L6-v2"
-else:
-    model_id = "sentence-transformers/all-mpnet-base-v2"
-    model_path = "./local_models/all-mpnet-base-v2"
-
-class ChromaEmbeddingFunction:
-    def __init__(self, model_path: str, model_id: str):
-        self.model_path = model_path
-
-        if not os.path.isdir(model_path):
-            os.makedirs(model_path, exist_ok=True)
-            print(f"Downloading and saving model to {model_path}...")
-            model = SentenceTransformer(model_id)
-            model.save(model_path)
-
-        self.embedder = HuggingFaceEmbeddings(model_name=model_path)
-
-    def __call__(self, input: List[str]) -> List[List[float]]:
-        return self.embedder.embed_documents(input)
-
-# embedding_func = ChromaEmbeddingFunction(model_path, model_id)
-
-chroma_client = chromadb.PersistentClient(path="./chroma_store")
-pdf_chunks_collection = chroma_client.get_or_create_collection(
-    name="pdf_chunks",
-    # embedding_function=embedding_func
-)
 
 def create_app():
     app = Flask(__name__)
+    app.request_class = UploadRequest
     app.config["MONGO_URI"] = "mongodb://localhost:27017/chad_pdf"
     app.config["DEBUG"] = True
+    app.config["CHROMA_PATH"] = "./chroma_store"
+    # opt-in: a chunk shared by PDFs in different partitions is stored once per partition
+    app.config["CHROMA_PARTITIONS"] = int(os.getenv("CHROMA_PARTITIONS", 1))
+    app.config["CHROMA_HNSW_SPACE"] = os.getenv("CHROMA_HNSW_SPACE", "l2")
+    app.config["CHROMA_HNSW_M"] = int(os.getenv("CHROMA_HNSW_M", 16))
+    app.config["CHROMA_HNSW_CONSTRUCTION_EF"] = int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", 100))
+    app.config["CHROMA_HNSW_SEARCH_EF"] = int(os.getenv("CHROMA_HNSW_SEARCH_EF", 100))
+    app.config["RETRIEVAL_MAX_DISTANCE"] = os.getenv("RETRIEVAL_MAX_DISTANCE")
+    app.config["MAX_UPLOAD_BYTES"] = int(os.getenv("MAX_UPLOAD_BYTES", 200 * 1024 * 1024))
+    # werkzeug rejects larger bodies before parsing them; the slack covers multipart framing
+    app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_UPLOAD_BYTES"] + (1 << 20)
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", 0)) or None
+    app.config["JOB_QUEUE_MAX_DEPTH"] = int(os.getenv("JOB_QUEUE_MAX_DEPTH", 100))
+    app.config["SUMMARY_WAIT_SECONDS"] = float(os.getenv("SUMMARY_WAIT_SECONDS", 60))
+    app.config["COMPLETION_CACHE_ENABLED"] = os.getenv("COMPLETION_CACHE_ENABLED", "0") == "1"
+    app.config["COMPLETION_CACHE_TTL"] = int(os.getenv("COMPLETION_CACHE_TTL", 86400))
+    app.config["COMPLETION_CACHE_MAX_ENTRIES"] = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 5000))
+    app.config["COMPLETION_CACHE_HISTORY_WINDOW"] = int(os.getenv("COMPLETION_CACHE_HISTORY_WINDOW", 4))
+    app.config["COMPLETION_CACHE_SEMANTIC"] = os.getenv("COMPLETION_CACHE_SEMANTIC", "0") == "1"
+    app.config["COMPLETION_CACHE_SEMANTIC_THRESHOLD"] = float(os.getenv("COMPLETION_CACHE_SEMANTIC_THRESHOLD", 0.95))
     mongo.init_app(app)
+    job_queue.init_app(app)
+    chroma.init_app(app)
+    completion_cache.init_app(app)
     register_routes(app)
     CORS(app, support_credentials=True)
-    app.chroma_client = chroma_client
-    app.pdf_chunks_collection = pdf_chunks_collection
     return app
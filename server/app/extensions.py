@@ -1,3 +1,13 @@
 from flask_pymongo import PyMongo
+from app.utils.job_queue import JobQueue
+from app.utils.vector_store import ChromaStore
+from app.utils.retrieval_cache import RetrievalCache
+from app.utils.key_scheduler import KeyScheduler
+from app.utils.completion_cache import CompletionCache
 
 mongo = PyMongo()
+job_queue = JobQueue()
+chroma = ChromaStore()
+retrieval_cache = RetrievalCache()
+key_scheduler = KeyScheduler()
+completion_cache = CompletionCache()
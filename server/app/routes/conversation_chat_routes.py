@@ -1,20 +1,87 @@
-from flask import Blueprint, request, jsonify, current_app
-from app.extensions import mongo
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from app.extensions import mongo, chroma, retrieval_cache
 from bson import ObjectId
 import time
-from gtts import gTTS
 import io
+import json
 import base64
 import os
 from app.utils.embeddings import EmbeddingsUtils
 from app.utils.llm_api import LLMApi, SYSTEM_PROMPT, FULL_PDF_SYSTEM_PROMPT
 from app.utils.pdf_preprocess import PDFUtils
+from app.utils.retrieval_cache import RetrievalCache
+from app.utils.lexical_index import LexicalIndex
+from app.utils.context_selection import ContextSelector, RAG_CANDIDATES
+from app.utils.token_budget import TokenBudget
 
 conversation_chat_bp = Blueprint('conversation_chat', __name__)
 
-def embedding_reply(user_message, allowed_pdf_ids):
-    collection = current_app.pdf_chunks_collection
-    results = EmbeddingsUtils.query_pdf_chunks(collection, user_message, allowed_pdf_ids, n_results=5)
+RETRIEVAL_MODES = ("hybrid", "dense", "lexical")
+HYBRID_CANDIDATES = 4
+
+def _pdf_docs(allowed_pdf_ids):
+    obj_ids = []
+    for pdf_id in allowed_pdf_ids:
+        try:
+            obj_ids.append(ObjectId(pdf_id))
+        except Exception:
+            continue
+    return {
+        str(doc["_id"]): doc
+        for doc in mongo.db.pdf_files.find({"_id": {"$in": obj_ids}}, {"filename": 1, "hash": 1})
+    }
+
+def retrieve_chunks(user_message, allowed_pdf_ids, n_results=5, mode="hybrid"):
+    # hybrid fuses the Chroma ranking with a BM25 ranking over the same chunks;
+    # lexical skips the embedding model entirely
+    def search():
+        pdf_docs = _pdf_docs(allowed_pdf_ids)
+        candidates = n_results * HYBRID_CANDIDATES if mode == "hybrid" else n_results
+
+        dense = None
+        if mode != "lexical":
+            dense = EmbeddingsUtils.query_pdf_chunks(chroma, user_message, allowed_pdf_ids, n_results=candidates)
+        lexical = None
+        if mode != "dense":
+            scope = [(pdf_id, pdf_docs.get(pdf_id, {}).get("hash")) for pdf_id in allowed_pdf_ids]
+            lexical = LexicalIndex.search(scope, user_message, candidates)
+        if dense is None and not lexical and mode != "lexical":
+            return None
+
+        hits = {}
+        dense_ranking, lexical_ranking = [], []
+        if dense is not None:
+            for text, meta, distance in zip(dense["documents"][0], dense["metadatas"][0], dense["distances"][0]):
+                key = (meta["pdf_id"], meta["page"], EmbeddingsUtils.chunk_id(text))
+                hits.setdefault(key, {"text": text, "distance": distance, "meta": meta})
+                dense_ranking.append(key)
+        for hit in lexical or []:
+            key = (hit["pdf_id"], hit["page"], EmbeddingsUtils.chunk_id(hit["text"]))
+            hits.setdefault(key, {"text": hit["text"], "distance": None, "meta": hit})
+            lexical_ranking.append(key)
+
+        results = {"documents": [[]], "metadatas": [[]], "distances": [[]], "filenames": [[]]}
+        for key, _ in LexicalIndex.fuse([dense_ranking, lexical_ranking])[:n_results]:
+            pdf_id, page, _ = key
+            meta = hits[key]["meta"]
+            results["documents"][0].append(hits[key]["text"])
+            results["metadatas"][0].append({
+                "pdf_id": pdf_id,
+                "page": page,
+                "pages": meta.get("pages") or [page],
+                "hash": meta.get("hash"),
+                "start": meta.get("start"),
+                "end": meta.get("end")
+            })
+            results["distances"][0].append(hits[key]["distance"])
+            results["filenames"][0].append(pdf_docs.get(pdf_id, {}).get("filename", "Unknown"))
+        return results
+
+    key = RetrievalCache.key(user_message, allowed_pdf_ids, n_results, mode)
+    return retrieval_cache.get_or_compute(key, search)
+
+def embedding_reply(user_message, allowed_pdf_ids, mode="hybrid"):
+    results = retrieve_chunks(user_message, allowed_pdf_ids, n_results=5, mode=mode)
     
     if not results or not results['documents'][0]:
         return "I’m sorry, I couldn’t find any relevant sections in the document. Could you rephrase or give me more details about what you’re looking for?"
@@ -25,11 +92,12 @@ def embedding_reply(user_message, allowed_pdf_ids):
         meta = results['metadatas'][0][i]
         distance = results['distances'][0][i]
         pdf_id = meta.get('pdf_id', 'N/A')
-        page = meta.get('page', 'N/A')
+        page = ", ".join(str(p) for p in meta.get('pages') or [meta.get('page', 'N/A')])
         
+        match = f"Distance: {distance:.4f}" if distance is not None else "Keyword match"
         markdown_chunk = (
             f"> {chunk_text.replace('\n', '\n> ')}\n\n"
-            f"Distance: {distance:.4f}  \n"
+            f"{match}  \n"
             f"PDF ID: `{pdf_id}`  \n"
             f"Page: {page}\n"
         )
@@ -60,10 +128,13 @@ def chat_with_conversation(conversation_id):
     user_message = data["message"]
     embedding_only = data.get("embedding_only", False)
     use_full_pdf = data.get("use_full_pdf", False)
+    retrieval = data.get("retrieval", "hybrid")
     similarity_scores = conv.get("similarity_scores", [])
+    if retrieval not in RETRIEVAL_MODES:
+        return jsonify({"error": f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
 
     if embedding_only:
-        embeddings_response = embedding_reply(user_message, allowed_pdf_ids)
+        embeddings_response = embedding_reply(user_message, allowed_pdf_ids, retrieval)
         return jsonify({
             "history": [
                 {
@@ -89,14 +160,20 @@ def chat_with_conversation(conversation_id):
     if use_full_pdf:
         context_chunks = get_full_pdf_context(allowed_pdf_ids)
     else:
-        context_chunks = get_relevant_context(user_message, allowed_pdf_ids)
+        context_chunks = get_relevant_context(user_message, allowed_pdf_ids, mode=retrieval)
 
     history = LLMApi.get_conversation_history(conversation_id)
-    messages = build_llm_messages(history, user_message, context_chunks, full_pdf_mode=use_full_pdf, similarity_scores=similarity_scores)
     model = data.get("model", "llama3-70b-8192")
+    messages = build_llm_messages(history, user_message, context_chunks, full_pdf_mode=use_full_pdf, similarity_scores=similarity_scores, model_name=model)
+
+    # full mode sends whole documents, so only retrieval turns may reuse a similar question's answer
+    semantic = None if use_full_pdf else {"query": user_message, "scope": allowed_pdf_ids}
+
+    if data.get("stream", False):
+        return stream_reply(conversation_id, model, messages, semantic)
     
     try:
-        assistant_response = LLMApi.send_message(model, messages)
+        assistant_response = LLMApi.send_message(model, messages, semantic=semantic)
     except Exception as e:
         error_message = f"Error communicating with LLM API: {str(e)}"
         model_entry = {
@@ -121,6 +198,49 @@ def chat_with_conversation(conversation_id):
     updated = mongo.db.conversations.find_one({"_id": ObjectId(conversation_id)})
     return jsonify({"history": updated.get("history", [])}), 200
 
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+def stream_reply(conversation_id, model, messages, semantic=None):
+    # tokens go out as they arrive; the assistant message is stored once the stream ends
+    def generate():
+        parts = []
+        try:
+            for token in LLMApi.stream_message(model, messages, semantic=semantic):
+                parts.append(token)
+                yield _sse("token", {"content": token})
+        except GeneratorExit:
+            # client went away; keep what was generated so the history stays consistent
+            if parts:
+                mongo.db.conversations.update_one(
+                    {"_id": ObjectId(conversation_id)},
+                    {"$push": {"history": {"role": "assistant", "content": "".join(parts)}}}
+                )
+            raise
+        except Exception as e:
+            error_message = f"Error communicating with LLM API: {str(e)}"
+            # tokens already sent stay in the history, followed by the error
+            content = "\n\n".join(["".join(parts), error_message]) if parts else error_message
+            mongo.db.conversations.update_one(
+                {"_id": ObjectId(conversation_id)},
+                {"$push": {"history": {"role": "assistant", "content": content}}}
+            )
+            yield _sse("error", {"error": error_message})
+            return
+
+        mongo.db.conversations.update_one(
+            {"_id": ObjectId(conversation_id)},
+            {"$push": {"history": {"role": "assistant", "content": "".join(parts)}}}
+        )
+        updated = mongo.db.conversations.find_one({"_id": ObjectId(conversation_id)})
+        yield _sse("done", {"history": updated.get("history", [])})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @conversation_chat_bp.route("/conversation/<conversation_id>/with-tts", methods=["POST"])
 def chat_with_conversation_tts(conversation_id):
     data = request.get_json()
@@ -142,7 +262,10 @@ def chat_with_conversation_tts(conversation_id):
     allowed_pdf_ids = [str(item["id"]) if isinstance(item["id"], ObjectId) else str(item["id"]) for item in pdf_meta if "id" in item]
     user_message = data["message"]
     use_full_pdf = data.get("use_full_pdf", False)
+    retrieval = data.get("retrieval", "hybrid")
     similarity_scores = conv.get("similarity_scores", [])
+    if retrieval not in RETRIEVAL_MODES:
+        return jsonify({"error": f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
 
     user_entry = {
         "role": "user",
@@ -156,13 +279,14 @@ def chat_with_conversation_tts(conversation_id):
     if use_full_pdf:
         context_chunks = get_full_pdf_context(allowed_pdf_ids)
     else:
-        context_chunks = get_relevant_context(user_message, allowed_pdf_ids)
+        context_chunks = get_relevant_context(user_message, allowed_pdf_ids, mode=retrieval)
     history = LLMApi.get_conversation_history(conversation_id)
-    messages = build_llm_messages(history, user_message, context_chunks, full_pdf_mode=use_full_pdf, similarity_scores=similarity_scores)
     model = data.get("model", "llama3-70b-8192")
+    messages = build_llm_messages(history, user_message, context_chunks, full_pdf_mode=use_full_pdf, similarity_scores=similarity_scores, model_name=model)
+    semantic = None if use_full_pdf else {"query": user_message, "scope": allowed_pdf_ids}
 
     try:
-        assistant_response = LLMApi.send_message(model, messages)
+        assistant_response = LLMApi.send_message(model, messages, semantic=semantic)
     except Exception as e:
         error_message = f"Error communicating with LLM API: {str(e)}"
         model_entry = {
@@ -184,6 +308,7 @@ def chat_with_conversation_tts(conversation_id):
         {"$push": {"history": model_entry}}
     )
 
+    from gtts import gTTS
     mp3_fp = io.BytesIO()
     tts = gTTS(text=assistant_response, lang='en')
     tts.write_to_fp(mp3_fp)
@@ -221,28 +346,32 @@ def clear_conversation_history(conversation_id):
         "conversation_id": conversation_id
     }), 200
 
-def get_relevant_context(user_message, allowed_pdf_ids, n_results=5):
-    collection = current_app.pdf_chunks_collection
-    results = EmbeddingsUtils.query_pdf_chunks(collection, user_message, allowed_pdf_ids, n_results=n_results)
+def get_relevant_context(user_message, allowed_pdf_ids, n_results=RAG_CANDIDATES, mode="hybrid"):
+    results = retrieve_chunks(user_message, allowed_pdf_ids, n_results=n_results, mode=mode)
 
     if not results or not results['documents'][0]:
         return []
-    
-    context_chunks = []
-    for i in range(len(results['documents'][0])):
-        chunk_text = results['documents'][0][i]
-        meta = results['metadatas'][0][i]
-        pdf_id = meta.get('pdf_id', 'N/A')
-        page = meta.get('page', 'N/A')
 
-        try:
-            pdf_doc = mongo.db.pdf_files.find_one({"_id": ObjectId(pdf_id)})
-            filename = pdf_doc.get("filename", "Unknown") if pdf_doc else "Unknown"
-        except Exception:
-            filename = "Unknown"
+    # overlapping chunks of a page are merged, then MMR picks blocks under the token budget
+    candidates = [
+        dict(meta, text=text, filename=filename)
+        for text, meta, filename in zip(results['documents'][0], results['metadatas'][0], results['filenames'][0])
+    ]
+    blocks = ContextSelector.select(candidates)
+    current_app.logger.info(
+        f"RAG context: {len(candidates)} chunks / {sum(len(c['text']) for c in candidates)} chars -> "
+        f"{len(blocks)} blocks / {sum(len(b['text']) for b in blocks)} chars"
+    )
 
-        pdf_nav = f'<!-- pdfnav: name="{filename}" page={page} id={pdf_id} -->'
-        context_chunk = f"{pdf_nav}\n{chunk_text}"
+    context_chunks = []
+    for block in blocks:
+        pdf_id = block.get('pdf_id', 'N/A')
+        pages = block.get('pages') or [block.get('page', 'N/A')]
+        filename = block['filename']
+
+        # the same passage can repeat across pages; tag every page it appears on
+        pdf_nav = "\n".join(f'<!-- pdfnav: name="{filename}" page={page} id={pdf_id} -->' for page in pages)
+        context_chunk = f"{pdf_nav}\n{block['text']}"
         context_chunks.append(context_chunk)
 
     return context_chunks
@@ -265,7 +394,7 @@ def get_full_pdf_context(allowed_pdf_ids):
                 print("File doesnt exist")
                 continue
 
-            page_texts = PDFUtils.get_pdf_content(file_path)
+            page_texts = PDFUtils.get_pdf_content(file_path, pdf_doc.get("hash"))
 
             for page_num, text in enumerate(page_texts, start=1):
                 pdf_nav = f'<!-- pdfnav: name="{filename}" page={page_num} id={pdf_id} -->'
@@ -277,18 +406,18 @@ def get_full_pdf_context(allowed_pdf_ids):
 
     return full_pdf_context
 
-def build_llm_messages(history, user_message, context_chunks, remove_stopwords=False, full_pdf_mode=False, similarity_scores=None):
-    # TODO clean markdown, less token, limit context window
+def build_llm_messages(history, user_message, context_chunks, remove_stopwords=False, full_pdf_mode=False, similarity_scores=None, model_name=None):
     system_prompt = FULL_PDF_SYSTEM_PROMPT if full_pdf_mode else SYSTEM_PROMPT
     messages = [{"role": "system", "content": system_prompt}]
 
     if remove_stopwords:
         user_message = PDFUtils.remove_stopwords(user_message)
-        context_chunks = [PDFUtils.remove_stopwords(chunk) for chunk in context_chunks]
+        context_chunks = PDFUtils.remove_stopwords_batch(context_chunks)
 
+    past_messages = []
     if history:
         for entry in history[:-1]:
-            messages.append({
+            past_messages.append({
                 "role": entry["role"],
                 "content": entry["content"]
             })
@@ -320,6 +449,32 @@ def build_llm_messages(history, user_message, context_chunks, remove_stopwords=F
 
         similarity_scores = updated_scores
 
+    # the system prompt and the question are fixed; history and context share what the model window leaves
+    prompt_limit = TokenBudget.prompt_limit(model_name)
+    system_tokens = TokenBudget.message_tokens(messages[0])
+    query_tokens = TokenBudget.message_tokens({"content": format_user_message(user_message, [], full_pdf_mode, similarity_scores)})
+    history_budget, context_budget = TokenBudget.allocate(
+        prompt_limit - system_tokens - query_tokens,
+        sum(TokenBudget.message_tokens(message) for message in past_messages),
+        sum(TokenBudget.count(chunk) + 2 for chunk in context_chunks)
+    )
+    kept_history = TokenBudget.trim_history(past_messages, history_budget)
+    history_tokens = sum(TokenBudget.message_tokens(message) for message in kept_history)
+    kept_context = TokenBudget.trim_context(context_chunks, context_budget + history_budget - history_tokens)
+
+    messages.extend(kept_history)
+    messages.append({"role": "user", "content": format_user_message(user_message, kept_context, full_pdf_mode, similarity_scores)})
+
+    total_tokens = sum(TokenBudget.message_tokens(message) for message in messages)
+    current_app.logger.info(
+        f"Prompt tokens ({model_name}): system {system_tokens}, "
+        f"history {history_tokens} ({len(kept_history)}/{len(past_messages)} messages), "
+        f"context {total_tokens - system_tokens - history_tokens - query_tokens} ({len(kept_context)}/{len(context_chunks)} chunks), "
+        f"query {query_tokens}, total {total_tokens} of {prompt_limit}"
+    )
+    return messages
+
+def format_user_message(user_message, context_chunks, full_pdf_mode=False, similarity_scores=None):
     # Build the formatted user message with context and/or similarity info
     if context_chunks:
         # When context is present, include both context and similarity if available
@@ -337,6 +492,4 @@ def build_llm_messages(history, user_message, context_chunks, remove_stopwords=F
             formatted_message = f"{user_message}\n\n(Note: No PDF document was found)"
         else:
             formatted_message = f"{user_message}\n\n(Note: No relevant context was found)"
-
-    messages.append({"role": "user", "content": formatted_message})
-    return messages
\ No newline at end of file
+    return formatted_message
\ No newline at end of file
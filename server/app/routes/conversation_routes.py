@@ -1,12 +1,12 @@
 from flask import Blueprint, request, jsonify, current_app
-from app.extensions import mongo
+from app.extensions import mongo, job_queue
 from app.utils.response import clean_res
 import time
-import threading
 from bson import ObjectId
 import os
-from app.utils.llm_api import LLMApi
 from app.utils.pdf_preprocess import PDFUtils
+from app.utils.job_queue import QueueFullError, PRIORITY_SIMILARITY, PRIORITY_INTERACTIVE
+from app.routes.pdf_routes import summarize_pdf_job
 
 MAX_WORDS = 50000
 MAX_PDFS = 20
@@ -16,7 +16,6 @@ conversation_bp = Blueprint('conversation', __name__)
 def _async_calculate_similarity(conversation_id, app):
     with app.app_context():
         try:
-            time.sleep(3)
             conv_id = ObjectId(conversation_id)
             conversation = mongo.db.conversations.find_one({'_id': conv_id})
             if not conversation:
@@ -33,12 +32,15 @@ def _async_calculate_similarity(conversation_id, app):
 
             upload_folder = os.path.join(app.root_path, '..', 'uploads')
             pdf_paths = []
+            pdf_hashes = []
             
             for item in pdf_meta:
                 pdf_id = item.get('id')
                 file_path = os.path.join(upload_folder, f"{pdf_id}.pdf")
                 if os.path.exists(file_path):
+                    pdf_doc = mongo.db.pdf_files.find_one({'_id': ObjectId(pdf_id)}, {'hash': 1})
                     pdf_paths.append(file_path)
+                    pdf_hashes.append(pdf_doc.get('hash') if pdf_doc else None)
             
             if len(pdf_paths) < 2:
                 mongo.db.conversations.update_one(
@@ -47,7 +49,7 @@ def _async_calculate_similarity(conversation_id, app):
                 )
                 return
                 
-            similarity_scores = PDFUtils.compute_pdf_similarity_summaries(pdf_paths)
+            similarity_scores = PDFUtils.compute_pdf_similarity_summaries(pdf_paths, pdf_hashes)
             
             mongo.db.conversations.update_one(
                 {'_id': conv_id},
@@ -63,6 +65,26 @@ def _async_calculate_similarity(conversation_id, app):
                 )
             except:
                 pass
+            raise
+
+def _schedule_similarity(conversation_id, app):
+    try:
+        job = job_queue.submit(
+            'similarity', _async_calculate_similarity, conversation_id, app,
+            priority=PRIORITY_SIMILARITY
+        )
+    except QueueFullError:
+        app.logger.warning(f"Similarity calculation skipped for {conversation_id}: job queue is full")
+        mongo.db.conversations.update_one(
+            {'_id': ObjectId(conversation_id)},
+            {'$set': {'calculating_similarity': False}}
+        )
+        return None
+    mongo.db.conversations.update_one(
+        {'_id': ObjectId(conversation_id)},
+        {'$set': {'similarity_job_id': job.id}}
+    )
+    return job.id
 
 @conversation_bp.route("/conversation", methods=["GET"])
 def get_conversations():
@@ -134,11 +156,9 @@ def create_conversation():
     conversation_doc['id'] = conversation_id
 
     if len(cleaned_meta) > 1:
-        threading.Thread(
-            target=_async_calculate_similarity,
-            args=(conversation_id, current_app._get_current_object()),
-            daemon=True
-        ).start()
+        conversation_doc['similarity_job_id'] = _schedule_similarity(
+            conversation_id, current_app._get_current_object()
+        )
     return jsonify(clean_res(conversation_doc)), 201
 
 @conversation_bp.route("/conversation", methods=["DELETE"])
@@ -216,11 +236,7 @@ def update_conversation():
         return jsonify({'error': 'Conversation not found'}), 404
 
     if recalculate_similarity and len(data['pdfMeta']) > 1:
-        threading.Thread(
-            target=_async_calculate_similarity,
-            args=(data['id'], current_app._get_current_object()),
-            daemon=True
-        ).start()
+        _schedule_similarity(data['id'], current_app._get_current_object())
 
     updated = mongo.db.conversations.find_one({'_id': ObjectId(data['id'])})
     return jsonify(clean_res(updated)), 200
@@ -242,6 +258,7 @@ def summarize_all_pdfs(conversation_id):
 
     upload_folder = os.path.join(current_app.root_path, '..', 'uploads')
     summaries = []
+    pending = []
 
     for item in pdf_meta:
         pdf_id = item.get('id')
@@ -265,7 +282,11 @@ def summarize_all_pdfs(conversation_id):
             continue
 
         if pdf_doc.get('summarizing', False):
-            summaries.append({'pdf_id': pdf_id, 'error': 'Currently being summarized'})
+            summaries.append({
+                'pdf_id': pdf_id,
+                'error': 'Currently being summarized',
+                'job_id': pdf_doc.get('summary_job_id')
+            })
             continue
 
         mongo.db.pdf_files.update_one({'_id': obj_id}, {'$set': {'summarizing': True}})
@@ -276,25 +297,31 @@ def summarize_all_pdfs(conversation_id):
             summaries.append({'pdf_id': pdf_id, 'error': 'File not found on server'})
             continue
 
+        job = job_queue.submit(
+            'summarize', summarize_pdf_job,
+            pdf_id, file_path, pdf_doc.get('hash'), current_app._get_current_object(),
+            priority=PRIORITY_INTERACTIVE
+        )
+        mongo.db.pdf_files.update_one({'_id': obj_id}, {'$set': {'summary_job_id': job.id}})
+        pending.append((pdf_id, job))
+
+    # all summaries run side by side and share one deadline; unfinished ones are reported by job id
+    deadline = time.monotonic() + current_app.config.get("SUMMARY_WAIT_SECONDS", 60)
+    for pdf_id, job in pending:
         try:
-            summary = LLMApi.summarize_pdf_with_gemini(file_path)
+            summary = job.wait(max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            summaries.append({'pdf_id': pdf_id, 'job_id': job.id, 'status': job.status})
+            continue
         except Exception as e:
-            mongo.db.pdf_files.update_one({'_id': obj_id}, {'$unset': {'summarizing': ""}})
             summaries.append({'pdf_id': pdf_id, 'error': f'Summarization failed: {str(e)}'})
             continue
 
-        mongo.db.pdf_files.update_one(
-            {'_id': obj_id},
-            {
-                '$set': {'summary': summary},
-                '$unset': {'summarizing': ""}
-            }
-        )
-
         summaries.append({
             'pdf_id': pdf_id,
             'summary': summary,
             'cached': False
         })
 
-    return jsonify({'conversation_id': conversation_id, 'summaries': summaries}), 200
\ No newline at end of file
+    status = 202 if any('job_id' in entry and 'error' not in entry for entry in summaries) else 200
+    return jsonify({'conversation_id': conversation_id, 'summaries': summaries}), status
\ No newline at end of file
@@ -0,0 +1,11 @@
+from flask import Blueprint, jsonify
+from app.extensions import job_queue
+
+job_bp = Blueprint('job', __name__)
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(job_queue.position(job))), 200
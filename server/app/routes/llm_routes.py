@@ -0,0 +1,15 @@
+from flask import Blueprint, jsonify
+from app.extensions import key_scheduler, completion_cache
+from app.utils.llm_api import API_KEYS, SUMMARY_API_KEYS
+
+llm_bp = Blueprint('llm', __name__)
+
+@llm_bp.route('/llm/keys', methods=['GET'])
+def get_key_state():
+    groups = dict(API_KEYS)
+    groups['summary'] = SUMMARY_API_KEYS
+    return jsonify(key_scheduler.state(groups)), 200
+
+@llm_bp.route('/llm/cache-stats', methods=['GET'])
+def get_completion_cache_stats():
+    return jsonify(completion_cache.stats()), 200
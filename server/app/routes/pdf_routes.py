@@ -1,60 +1,84 @@
 import os
-import hashlib
-import threading
 from flask import Blueprint, jsonify, request
 from werkzeug.utils import secure_filename
-from app.extensions import mongo
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.extensions import mongo, job_queue, chroma, retrieval_cache
 from bson import ObjectId
 from app.utils.response import clean_res
 from flask_cors import cross_origin
 from flask import current_app, send_from_directory
 from app.utils.pdf_preprocess import PDFUtils
+from app.utils.embeddings import EmbeddingsUtils
 from app.utils.llm_api import LLMApi
+from app.utils.page_cache import PageCache
+from app.utils.lexical_index import LexicalIndex
+from app.utils.job_queue import QueueFullError, PRIORITY_INGEST, PRIORITY_INTERACTIVE
 
 pdf_bp = Blueprint('pdf', __name__)
 
-def _async_count_and_update(pdf_id, file_path, app):
-    with app.app_context():
-        if not os.path.exists(file_path):
-            app.logger.warning(f"Count aborted: file {file_path} no longer exists")
-            return
-
-        pdf_obj = mongo.db.pdf_files.find_one({'_id': pdf_id})
-        if not pdf_obj:
-            app.logger.warning(f"Count aborted: PDF record {pdf_id} already deleted")
-            return
-        try:
-            wc = PDFUtils.count_words_pdf(file_path)
-        except Exception as e:
-            app.logger.error(f"Word count failed for {pdf_id}: {e}")
-            wc = 0
-        mongo.db.pdf_files.update_one(
-            {'_id': pdf_id},
-            {'$set': {'word_count': wc}}
-        )
+@pdf_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    max_bytes = current_app.config.get("MAX_UPLOAD_BYTES")
+    return jsonify({'error': f'PDF exceeds the maximum upload size of {max_bytes // (1 << 20)} MB'}), 413
 
-def _async_vectorize(pdf_id: str, pdf_path: str, pdf_chunks_collection, app):
+def _async_ingest(pdf_id: str, pdf_path: str, file_hash: str, pdf_chunks_collection, app):
     with app.app_context():
         if not os.path.exists(pdf_path):
-            app.logger.warning(f"Vectorize aborted: file {pdf_path} no longer exists")
+            app.logger.warning(f"Ingestion aborted: file {pdf_path} no longer exists")
             return
         obj_id = ObjectId(pdf_id)
         pdf_obj = mongo.db.pdf_files.find_one({'_id': obj_id})
         if not pdf_obj:
-            app.logger.warning(f"Vectorize aborted: PDF record {pdf_id} already deleted")
+            app.logger.warning(f"Ingestion aborted: PDF record {pdf_id} already deleted")
             return
 
+        wc = 0
         try:
-            pdf_info = PDFUtils.extract_information(pdf_path)
-            PDFUtils.store_pdf_chunks_to_chroma(pdf_id, pdf_info, pdf_chunks_collection)
+            page_count = max(PDFUtils.count_pages(pdf_path), 1)
+            with PageCache.writer(file_hash) as page_store, LexicalIndex.writer(file_hash) as lexical_index:
+                def pages():
+                    nonlocal wc
+                    for page_data in PDFUtils.iter_information(pdf_path):
+                        page_store.append(page_data["text"])
+                        wc += PDFUtils.count_words_pages([page_data["text"]])
+                        job_queue.report_progress(page_data["page"] / page_count)
+                        yield page_data
+
+                PDFUtils.store_pdf_chunks_to_chroma(
+                    pdf_id, file_hash, pages(), pdf_chunks_collection, lexical_index=lexical_index
+                )
         except Exception as e:
-            app.logger.error(f"Vectorization failed for {pdf_id}: {e}")
+            app.logger.error(f"Ingestion failed for {pdf_id}: {e}")
+            wc = 0
+            EmbeddingsUtils.delete_pdf_chunks(pdf_chunks_collection, pdf_id)
+            # re-raised so the job queue records the ingest as failed, not done
+            raise
         finally:
+            retrieval_cache.invalidate_pdf(pdf_id)
+            chroma.scope_index.invalidate_pdf(pdf_id)
             mongo.db.pdf_files.update_one(
                 {'_id': obj_id},
-                {'$set': {'loading': False}}
+                {'$set': {'word_count': wc, 'loading': False}}
             )
 
+def summarize_pdf_job(pdf_id: str, file_path: str, file_hash: str, app):
+    # stores the result itself so a summary finishes even after the request stopped waiting
+    with app.app_context():
+        obj_id = ObjectId(pdf_id)
+        try:
+            summary = LLMApi.summarize_pdf_with_gemini(file_path, file_hash)
+        except Exception:
+            mongo.db.pdf_files.update_one({'_id': obj_id}, {'$unset': {'summarizing': "", 'summary_job_id': ""}})
+            raise
+        mongo.db.pdf_files.update_one(
+            {'_id': obj_id},
+            {
+                '$set': {'summary': summary},
+                '$unset': {'summarizing': "", 'summary_job_id': ""}
+            }
+        )
+        return summary
+
 @pdf_bp.route('/pdf', methods=['GET'])
 def get_all_pdf():
     pdfs = list(mongo.db.pdf_files.find({}, {'hash': 0}))
@@ -78,6 +102,10 @@ def get_single_pdf(pdf_id):
 
 @pdf_bp.route('/pdf', methods=['POST'])
 def upload_pdf():
+    # checked before request.files so a full queue turns the upload away unread
+    if job_queue.is_full():
+        return _busy_response()
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file part in the request'}), 400
 
@@ -85,8 +113,10 @@ def upload_pdf():
     if not file or not file.filename.lower().endswith('.pdf'):
         return jsonify({'error': 'Only PDF files are allowed'}), 400
 
-    file_content = file.read()
-    file_hash = hashlib.sha256(file_content).hexdigest()
+    # UploadRequest already hashed the part while parsing it into uploads/
+    upload_folder = os.path.join(current_app.root_path, '..', 'uploads')
+    upload = file.stream
+    file_hash = upload.hexdigest()
 
     existing = mongo.db.pdf_files.find_one({'hash': file_hash})
     if existing:
@@ -104,30 +134,84 @@ def upload_pdf():
     }
     pdf_id = mongo.db.pdf_files.insert_one(pdf_doc).inserted_id
 
-    upload_folder = os.path.join(current_app.root_path, '..', 'uploads')
-    os.makedirs(upload_folder, exist_ok=True)
     saved_path = os.path.join(upload_folder, f"{pdf_id}.pdf")
-    with open(saved_path, 'wb') as f:
-        f.write(file_content)
+    upload.claim(saved_path)
 
-    threading.Thread(
-        target=_async_count_and_update,
-        args=(pdf_id, saved_path, current_app._get_current_object()),
-        daemon=True
-    ).start()
-
-    threading.Thread(
-        target=_async_vectorize,
-        args=(str(pdf_id), saved_path, current_app.pdf_chunks_collection, current_app._get_current_object()),
-        daemon=True
-    ).start()
+    try:
+        job = job_queue.submit(
+            'ingest', _async_ingest,
+            str(pdf_id), saved_path, file_hash, chroma.partition(str(pdf_id)), current_app._get_current_object(),
+            priority=PRIORITY_INGEST
+        )
+    except QueueFullError:
+        os.remove(saved_path)
+        mongo.db.pdf_files.delete_one({'_id': pdf_id})
+        return _busy_response()
+    mongo.db.pdf_files.update_one({'_id': pdf_id}, {'$set': {'job_id': job.id}})
 
     return jsonify({
         'id': str(pdf_id),
         'filename': pdf_doc['filename'],
-        'existed': False
+        'existed': False,
+        'job_id': job.id
     }), 201
 
+def _busy_response():
+    return (
+        jsonify({'error': 'The server is busy processing other uploads. Please retry shortly.'}),
+        503,
+        {'Retry-After': '30'}
+    )
+
+def _has_chunks(pdf_id: str) -> bool:
+    found = chroma.partition(pdf_id).get(
+        where={EmbeddingsUtils.ref_key(pdf_id): {'$gte': 1}}, limit=1, include=[]
+    )
+    return len(found['ids']) > 0
+
+@pdf_bp.route('/pdf/reingest', methods=['POST'])
+def reingest_pdfs():
+    # PDFs ingested before chunks carried ref_<pdf_id> metadata (or whose ingest failed)
+    # have nothing retrievable; queue them through the normal ingest again
+    data = request.get_json(silent=True) or {}
+    query = {'loading': {'$ne': True}}
+    if data.get('ids'):
+        try:
+            query['_id'] = {'$in': [ObjectId(pdf_id) for pdf_id in data['ids']]}
+        except Exception:
+            return jsonify({'error': 'Invalid id format'}), 400
+
+    upload_folder = os.path.join(current_app.root_path, '..', 'uploads')
+    queued, skipped = [], []
+    for pdf_doc in mongo.db.pdf_files.find(query, {'hash': 1}):
+        pdf_id = str(pdf_doc['_id'])
+        if _has_chunks(pdf_id):
+            continue
+        file_path = os.path.join(upload_folder, f"{pdf_id}.pdf")
+        if not os.path.exists(file_path) or not pdf_doc.get('hash'):
+            skipped.append({'id': pdf_id, 'error': 'File not found on server'})
+            continue
+
+        collection = chroma.partition(pdf_id)
+        # chunks from the old schema were tagged with a plain pdf_id field
+        collection.delete(where={'pdf_id': pdf_id})
+        try:
+            job = job_queue.submit(
+                'ingest', _async_ingest,
+                pdf_id, file_path, pdf_doc['hash'], collection, current_app._get_current_object(),
+                priority=PRIORITY_INGEST
+            )
+        except QueueFullError:
+            skipped.append({'id': pdf_id, 'error': 'Job queue is full'})
+            continue
+        mongo.db.pdf_files.update_one(
+            {'_id': pdf_doc['_id']},
+            {'$set': {'loading': True, 'word_count': -1, 'job_id': job.id}}
+        )
+        queued.append({'id': pdf_id, 'job_id': job.id})
+
+    return jsonify({'queued': queued, 'skipped': skipped}), 202 if queued else 200
+
 @pdf_bp.route('/pdf', methods=['DELETE'])
 def delete_pdf():
     data = request.get_json()
@@ -164,7 +248,12 @@ def delete_pdf():
     if os.path.exists(file_path):
         os.remove(file_path)
 
-    current_app.pdf_chunks_collection.delete(where={"pdf_id": str(pdf_id)})
+    EmbeddingsUtils.delete_pdf_chunks(chroma.partition(str(pdf_id)), str(pdf_id))
+    retrieval_cache.invalidate_pdf(str(pdf_id))
+    chroma.scope_index.invalidate_pdf(str(pdf_id))
+    if pdf_doc.get('hash'):
+        PageCache.evict(pdf_doc['hash'])
+        LexicalIndex.evict(pdf_doc['hash'])
     mongo.db.pdf_files.delete_one({'_id': pdf_id})
     return jsonify({'deleted_id': data['id']}), 200
 
@@ -194,7 +283,10 @@ def summarize_pdf(pdf_id):
         }), 200
 
     if pdf_doc.get('summarizing', False):
-        return jsonify({'error': 'This PDF is currently being summarized'}), 409
+        return jsonify({
+            'error': 'This PDF is currently being summarized',
+            'job_id': pdf_doc.get('summary_job_id')
+        }), 409
 
     mongo.db.pdf_files.update_one({'_id': obj_id}, {'$set': {'summarizing': True}})
 
@@ -206,20 +298,20 @@ def summarize_pdf(pdf_id):
         mongo.db.pdf_files.update_one({'_id': obj_id}, {'$unset': {'summarizing': ""}})
         return jsonify({'error': 'PDF file not found on server'}), 404
 
+    job = job_queue.submit(
+        'summarize', summarize_pdf_job,
+        pdf_id, file_path, pdf_doc.get('hash'), current_app._get_current_object(),
+        priority=PRIORITY_INTERACTIVE
+    )
+    mongo.db.pdf_files.update_one({'_id': obj_id}, {'$set': {'summary_job_id': job.id}})
     try:
-        summary = LLMApi.summarize_pdf_with_gemini(file_path)
+        summary = job.wait(current_app.config.get("SUMMARY_WAIT_SECONDS", 60))
+    except TimeoutError:
+        # the workers are busy (e.g. a long ingest); the job keeps running and can be polled
+        return jsonify({'pdf_id': pdf_id, 'job_id': job.id, 'status': job.status}), 202
     except Exception as e:
-        mongo.db.pdf_files.update_one({'_id': obj_id}, {'$unset': {'summarizing': ""}})
         return jsonify({'error': f'Failed to summarize PDF: {str(e)}'}), 500
 
-    mongo.db.pdf_files.update_one(
-        {'_id': obj_id},
-        {
-            '$set': {'summary': summary},
-            '$unset': {'summarizing': ""}
-        }
-    )
-
     return jsonify({
         'summary': summary,
         'pdf_id': pdf_id,
@@ -1,9 +1,6 @@
 from flask import Blueprint, request, jsonify
-from gtts import gTTS
-from bs4 import BeautifulSoup, Comment
 import io
 import base64
-import mistune
 import re
 
 tts_bp = Blueprint('tts', __name__)
@@ -36,6 +33,8 @@ def extract_md_tables(text):
     return "".join(out)
 
 def markdown_to_text(md_content):
+    import mistune
+    from bs4 import BeautifulSoup, Comment
     md_content = re.sub(r'<!--\s*pdfnav:.*?-->', '', md_content)
     md_content = extract_md_tables(md_content)
     html = mistune.markdown(md_content)
@@ -69,6 +68,7 @@ def tts():
     print(cleaned_text)
     print("\n")
 
+    from gtts import gTTS
     mp3_fp = io.BytesIO()
     tts = gTTS(text=cleaned_text, lang='en')
     tts.write_to_fp(mp3_fp)
@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify, current_app
+from app.extensions import chroma, retrieval_cache
+from app.utils.embeddings import EmbeddingsUtils
 
 vector_bp = Blueprint('vector_bp', __name__)
 
+MAX_BATCH_QUERIES = 256
+MAX_BATCH_RESULTS = 50
+
 @vector_bp.route('/vector/search', methods=['POST'])
 def search_vector_chunks():
     data = request.get_json()
@@ -9,19 +14,67 @@ def search_vector_chunks():
         return jsonify({'error': 'Missing query'}), 400
 
     query = data['query']
-    collection = current_app.pdf_chunks_collection
 
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=5
-        )
+        hits = EmbeddingsUtils.query_partitions(chroma, EmbeddingsUtils.embed_query(query), n_results=5)
         matched_chunks = []
-        for i in range(len(results['documents'][0])):
+        for _, metadata in hits:
+            ref = EmbeddingsUtils.resolve_ref(metadata)
             matched_chunks.append({
-                'text': results['documents'][0][i],
-                'metadata': results['metadatas'][0][i]
+                'text': EmbeddingsUtils.chunk_text(metadata, ref['pdf_id']),
+                'metadata': ref
             })
         return jsonify({'matches': matched_chunks}), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@vector_bp.route('/vector/search/batch', methods=['POST'])
+def search_vector_chunks_batch():
+    data = request.get_json()
+    if not data or not isinstance(data.get('queries'), list) or not data['queries']:
+        return jsonify({'error': 'Missing queries'}), 400
+
+    queries = data['queries']
+    pdf_ids = data.get('pdf_ids')
+    n_results = data.get('n_results', 5)
+    max_distance = data.get('max_distance')
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per batch'}), 400
+    if not all(isinstance(query, str) and query.strip() for query in queries):
+        return jsonify({'error': 'Queries must be non-empty strings'}), 400
+    if not isinstance(n_results, int) or not 1 <= n_results <= MAX_BATCH_RESULTS:
+        return jsonify({'error': f'n_results must be between 1 and {MAX_BATCH_RESULTS}'}), 400
+    if pdf_ids is not None and (not isinstance(pdf_ids, list) or not pdf_ids):
+        return jsonify({'error': 'pdf_ids must be a non-empty list'}), 400
+    if max_distance is not None and not isinstance(max_distance, (int, float)):
+        return jsonify({'error': 'max_distance must be a number'}), 400
+    if pdf_ids is not None:
+        pdf_ids = [str(pdf_id) for pdf_id in pdf_ids]
+
+    try:
+        embeddings = EmbeddingsUtils.embed_queries(queries)
+        batch_hits = EmbeddingsUtils.query_partitions_batch(chroma, embeddings, pdf_ids, n_results)
+        results = []
+        for query, hits in zip(queries, batch_hits):
+            matched_chunks = []
+            for distance, metadata in hits:
+                if max_distance is not None and distance > max_distance:
+                    continue
+                ref = EmbeddingsUtils.resolve_ref(metadata, pdf_ids)
+                matched_chunks.append({
+                    'text': EmbeddingsUtils.chunk_text(metadata, ref['pdf_id']),
+                    'metadata': ref,
+                    'distance': distance
+                })
+            results.append({'query': query, 'matches': matched_chunks})
+        return jsonify({'results': results}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@vector_bp.route('/vector/cache-stats', methods=['GET'])
+def vector_cache_stats():
+    return jsonify({
+        'query_embeddings': EmbeddingsUtils.query_cache.stats(),
+        'retrieval': retrieval_cache.stats(),
+        'scope_index': chroma.scope_index.stats()
+    }), 200
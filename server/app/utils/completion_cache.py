@@ -0,0 +1,181 @@
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+SEMANTIC_CANDIDATES = 200
+EVICTION_CHECK_EVERY = 50
+
+class CompletionCache:
+    # completions persisted in Mongo: a TTL index expires old answers, and the least
+    # recently hit entries are dropped once the collection outgrows its cap. Off unless
+    # COMPLETION_CACHE_ENABLED=1: the key only covers the last few turns, so a cached answer
+    # can be replayed into a conversation whose earlier history differs
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexed = False
+        self._puts = 0
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.enabled = False
+        self.ttl = 86400
+        self.max_entries = 5000
+        self.history_window = 4
+        self.semantic = False
+        self.semantic_threshold = 0.95
+
+    def init_app(self, app):
+        self.enabled = app.config.get("COMPLETION_CACHE_ENABLED", self.enabled)
+        self.ttl = int(app.config.get("COMPLETION_CACHE_TTL", self.ttl))
+        self.max_entries = int(app.config.get("COMPLETION_CACHE_MAX_ENTRIES", self.max_entries))
+        self.history_window = int(app.config.get("COMPLETION_CACHE_HISTORY_WINDOW", self.history_window))
+        self.semantic = app.config.get("COMPLETION_CACHE_SEMANTIC", self.semantic)
+        self.semantic_threshold = float(app.config.get("COMPLETION_CACHE_SEMANTIC_THRESHOLD", self.semantic_threshold))
+
+    @property
+    def collection(self):
+        from app.extensions import mongo
+        collection = mongo.db.completion_cache
+        if not self._indexed:
+            with self._lock:
+                if not self._indexed:
+                    collection.create_index("expires_at", expireAfterSeconds=0)
+                    collection.create_index("last_hit")
+                    collection.create_index([("model", 1), ("scope", 1), ("history_hash", 1), ("last_hit", -1)])
+                    self._indexed = True
+        return collection
+
+    @staticmethod
+    def _hash(value) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def window(self, messages: list) -> tuple:
+        # system prompt, the last few turns, and the final user message with its context
+        system = [m for m in messages[:1] if m.get("role") == "system"]
+        turns = messages[len(system):-1][-self.history_window:] if self.history_window else []
+        return system, turns, messages[-1:]
+
+    def key(self, model: str, messages: list) -> str:
+        system, turns, last = self.window(messages)
+        return self._hash({
+            "model": model,
+            "system": [m.get("content") for m in system],
+            "history": [(m.get("role"), m.get("content")) for m in turns],
+            "prompt": [m.get("content") for m in last]
+        })
+
+    def history_hash(self, messages: list) -> str:
+        _, turns, _ = self.window(messages)
+        return self._hash([(m.get("role"), m.get("content")) for m in turns])
+
+    def get(self, key: str) -> str | None:
+        if not self.enabled:
+            return None
+        try:
+            entry = self.collection.find_one_and_update(
+                {"_id": key},
+                {"$set": {"last_hit": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+                projection={"content": 1}
+            )
+        except Exception:
+            return None
+        return entry["content"] if entry else None
+
+    def record(self, hit: bool, semantic: bool = False):
+        with self._lock:
+            if not hit:
+                self.misses += 1
+            elif semantic:
+                self.semantic_hits += 1
+            else:
+                self.hits += 1
+
+    def find_similar(self, model: str, scope, messages: list, embedding) -> str | None:
+        # same model, PDF scope and history window; only the wording of the question differs
+        if not (self.enabled and self.semantic):
+            return None
+        import numpy as np
+        try:
+            candidates = self.collection.find(
+                {
+                    "model": model,
+                    "scope": sorted(scope),
+                    "history_hash": self.history_hash(messages),
+                    "embedding": {"$exists": True}
+                },
+                {"content": 1, "embedding": 1}
+            ).sort("last_hit", -1).limit(SEMANTIC_CANDIDATES)
+            candidates = list(candidates)
+        except Exception:
+            return None
+        if not candidates:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        matrix = np.asarray([entry["embedding"] for entry in candidates], dtype=np.float32)
+        similarity = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.semantic_threshold:
+            return None
+        try:
+            self.collection.update_one(
+                {"_id": candidates[best]["_id"]},
+                {"$set": {"last_hit": datetime.now(timezone.utc)}, "$inc": {"hits": 1}}
+            )
+        except Exception:
+            pass
+        return candidates[best]["content"]
+
+    def put(self, key: str, model: str, content: str, messages: list, scope=None, embedding=None):
+        if not self.enabled or not content:
+            return
+        now = datetime.now(timezone.utc)
+        entry = {
+            "model": model,
+            "content": content,
+            "created_at": now,
+            "last_hit": now,
+            "expires_at": now + timedelta(seconds=self.ttl),
+            "hits": 0
+        }
+        if scope is not None and embedding is not None:
+            entry["scope"] = sorted(scope)
+            entry["history_hash"] = self.history_hash(messages)
+            entry["embedding"] = [float(value) for value in embedding]
+        try:
+            self.collection.replace_one({"_id": key}, entry, upsert=True)
+            with self._lock:
+                self._puts += 1
+                check = self._puts % EVICTION_CHECK_EVERY == 0
+            if check:
+                self._evict()
+        except Exception:
+            return
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            stats = {
+                "enabled": self.enabled,
+                "semantic": self.semantic,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl
+            }
+        try:
+            stats["entries"] = self.collection.estimated_document_count()
+        except Exception:
+            stats["entries"] = None
+        return stats
+
+    def _evict(self):
+        overflow = self.collection.estimated_document_count() - self.max_entries
+        if overflow <= 0:
+            return
+        stale = [entry["_id"] for entry in self.collection.find({}, {"_id": 1}).sort("last_hit", 1).limit(overflow)]
+        if stale:
+            self.collection.delete_many({"_id": {"$in": stale}})
@@ -0,0 +1,109 @@
+import os
+from app.utils.page_cache import PageCache
+from app.utils.lexical_index import tokenize
+from app.utils.token_budget import TokenBudget
+
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 1200))
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", 12))
+MMR_LAMBDA = 0.7
+MAX_BLOCK_CHARS = 2000
+
+class ContextSelector:
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return max(1, TokenBudget.count(text))
+
+    @staticmethod
+    def merge_spans(candidates: list[dict]) -> list[dict]:
+        # candidates are ranked best first and carry pdf_id, page, hash, start, end, text;
+        # overlapping or touching spans of one page become a single block holding the
+        # best rank of its members
+        blocks, loose = [], []
+        groups = {}
+        for rank, candidate in enumerate(candidates):
+            candidate = dict(candidate, rank=rank)
+            if candidate.get("hash") is None or candidate.get("start") is None:
+                loose.append(candidate)
+                continue
+            groups.setdefault((candidate["pdf_id"], candidate["page"], candidate["hash"]), []).append(candidate)
+
+        for (_, page, file_hash), members in groups.items():
+            pages = PageCache.get(file_hash)
+            if not pages or page > len(pages):
+                blocks.extend(members)
+                continue
+
+            members.sort(key=lambda member: member["start"])
+            merged = [members[0]]
+            for member in members[1:]:
+                current = merged[-1]
+                if member["end"] <= current["end"]:
+                    current["rank"] = min(current["rank"], member["rank"])
+                elif member["start"] > current["end"]:
+                    merged.append(member)
+                elif member["end"] - current["start"] <= MAX_BLOCK_CHARS:
+                    current["end"] = member["end"]
+                    current["rank"] = min(current["rank"], member["rank"])
+                    # the extended span only exists on this page
+                    current["pages"] = [page]
+                else:
+                    # too long to grow further; keep only the part not already covered
+                    member["start"] = current["end"]
+                    merged.append(member)
+
+            for block in merged:
+                block["text"] = pages[page - 1][block["start"]:block["end"]]
+            blocks.extend(merged)
+
+        return sorted(blocks + loose, key=lambda block: block["rank"])
+
+    @staticmethod
+    def _similarity(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    @staticmethod
+    def mmr(blocks: list[dict], token_budget: int, lambda_: float = MMR_LAMBDA) -> list[dict]:
+        # relevance comes from the retrieval rank; redundancy is token overlap with what is
+        # already selected, so no extra embedding calls are needed
+        if not blocks:
+            return []
+        count = len(blocks)
+        for block in blocks:
+            block["relevance"] = 1 - block["rank"] / (count + 1)
+            block["terms"] = set(tokenize(block["text"]))
+            block["tokens"] = ContextSelector.estimate_tokens(block["text"])
+
+        selected, remaining, used = [], list(blocks), 0
+        while remaining:
+            best, best_score = None, None
+            for block in remaining:
+                redundancy = max(
+                    (ContextSelector._similarity(block["terms"], chosen["terms"]) for chosen in selected),
+                    default=0.0
+                )
+                score = lambda_ * block["relevance"] - (1 - lambda_) * redundancy
+                if best_score is None or score > best_score:
+                    best, best_score = block, score
+            remaining.remove(best)
+            if used + best["tokens"] > token_budget:
+                if selected:
+                    continue
+                # nothing fits yet; keep the head of the top block rather than exceed the budget
+                best["text"] = TokenBudget.truncate(best["text"], token_budget)
+                if not best["text"]:
+                    continue
+                if best.get("start") is not None:
+                    best["end"] = best["start"] + len(best["text"])
+                best["tokens"] = TokenBudget.count(best["text"])
+            selected.append(best)
+            used += best["tokens"]
+
+        for block in selected:
+            del block["relevance"], block["terms"], block["tokens"]
+        return selected
+
+    @staticmethod
+    def select(candidates: list[dict], token_budget: int = RAG_CONTEXT_TOKEN_BUDGET) -> list[dict]:
+        return ContextSelector.mmr(ContextSelector.merge_spans(candidates), token_budget)
@@ -0,0 +1,147 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "chroma-default")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "fp32")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))
+# overrides the ONNX export picked by precision, e.g. onnx/model_qint8_avx512_vnni.onnx
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE")
+
+LOCAL_MODEL_DIR = "./local_models"
+
+MODELS = {
+    "all-MiniLM-L6-v2": {"model_id": "sentence-transformers/all-MiniLM-L6-v2", "dimensions": 384},
+    "all-mpnet-base-v2": {"model_id": "sentence-transformers/all-mpnet-base-v2", "dimensions": 768},
+}
+
+# exports published alongside both models on the Hugging Face hub; the int8 build for
+# AVX2 is the unsigned one, the signed qint8 builds target AVX-512, VNNI and ARM64
+ONNX_FILES = {
+    "fp32": "onnx/model.onnx",
+    "int8": "onnx/model_quint8_avx2.onnx",
+}
+
+class EmbeddingBackend(ABC):
+    name = ""
+
+    def __init__(self, model: str, precision: str, batch_size: int, threads: int):
+        if model not in MODELS:
+            raise ValueError(f"Unknown embedding model: {model}")
+        if precision not in ONNX_FILES:
+            raise ValueError(f"Unknown embedding precision: {precision}")
+        self.model = model
+        self.model_id = MODELS[model]["model_id"]
+        self.dimensions = MODELS[model]["dimensions"]
+        self.precision = precision
+        self.batch_size = batch_size
+        self.threads = threads
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> list:
+        ...
+
+    def __call__(self, input: list[str]) -> list:
+        return self.embed(input)
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "model": self.model,
+            "precision": self.precision,
+            "batch_size": self.batch_size,
+            "threads": self.threads,
+            "dimensions": self.dimensions,
+        }
+
+class ChromaDefaultBackend(EmbeddingBackend):
+    # Chroma's bundled ONNX all-MiniLM-L6-v2; what every existing index was built with
+    name = "chroma-default"
+
+    def __init__(self, model, precision, batch_size, threads):
+        super().__init__(model, precision, batch_size, threads)
+        if model != "all-MiniLM-L6-v2" or precision != "fp32":
+            raise ValueError("chroma-default only provides fp32 all-MiniLM-L6-v2")
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        self._function = DefaultEmbeddingFunction()
+
+    def embed(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._function(texts[start:start + self.batch_size]))
+        return embeddings
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    name = "sentence-transformers"
+
+    def __init__(self, model, precision, batch_size, threads):
+        super().__init__(model, precision, batch_size, threads)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            torch.set_num_threads(threads)
+        self._model = SentenceTransformer(self.model_id, device="cpu", cache_folder=LOCAL_MODEL_DIR)
+        if precision == "int8":
+            self._model = torch.quantization.quantize_dynamic(self._model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def embed(self, texts):
+        return list(self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ))
+
+class OnnxBackend(SentenceTransformerBackend):
+    name = "onnx"
+
+    def __init__(self, model, precision, batch_size, threads):
+        EmbeddingBackend.__init__(self, model, precision, batch_size, threads)
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        self._model = SentenceTransformer(
+            self.model_id,
+            device="cpu",
+            backend="onnx",
+            cache_folder=LOCAL_MODEL_DIR,
+            model_kwargs={
+                "file_name": EMBEDDING_ONNX_FILE or ONNX_FILES[precision],
+                "provider": "CPUExecutionProvider",
+                "session_options": session_options,
+            }
+        )
+
+BACKENDS = {
+    ChromaDefaultBackend.name: ChromaDefaultBackend,
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def create_backend(name=EMBEDDING_BACKEND, model=EMBEDDING_MODEL, precision=EMBEDDING_PRECISION,
+                   batch_size=EMBEDDING_BATCH_SIZE, threads=EMBEDDING_THREADS) -> EmbeddingBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return BACKENDS[name](model, precision, batch_size, threads)
+
+def get_backend() -> EmbeddingBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+def collection_name(base: str = "pdf_chunks") -> str:
+    # vectors from different models live in different spaces and dimensions
+    if EMBEDDING_MODEL == "all-MiniLM-L6-v2":
+        return base
+    return f"{base}_{EMBEDDING_MODEL}"
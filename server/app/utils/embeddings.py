@@ -1,22 +1,326 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from app.utils.page_cache import PageCache
+from app.utils.embedding_backends import get_backend
+
+REF_PREFIX = "ref_"
+LOC_PREFIX = "loc_"
+LOC_SEPARATOR = ";"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def get(self, text: str, embed):
+        key = self.normalize(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            self.misses += 1
+
+        embedding = embed([key])[0]
+        self._store({key: embedding})
+        return embedding
+
+    def get_many(self, texts: list[str], embed) -> list:
+        # misses are embedded together in one backend call
+        keys = [self.normalize(text) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = embedding
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            computed = dict(zip(missing, embed(missing)))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def _store(self, embeddings: dict):
+        with self._lock:
+            for key, embedding in embeddings.items():
+                self._entries[key] = embedding
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
 class EmbeddingsUtils:
+    _refs_lock = threading.Lock()
+    query_cache = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE)
+
     @staticmethod
-    def query_pdf_chunks(collection, user_message, allowed_pdf_ids, n_results=5):
-        try:
+    def embedding_function():
+        return get_backend()
+
+    @staticmethod
+    def embed_query(text: str):
+        return EmbeddingsUtils.query_cache.get(text, EmbeddingsUtils.embedding_function())
+
+    @staticmethod
+    def embed_queries(texts: list[str]) -> list:
+        return EmbeddingsUtils.query_cache.get_many(texts, EmbeddingsUtils.embedding_function())
+
+    @staticmethod
+    def chunk_id(text: str) -> str:
+        normalized = re.sub(r'\s+', ' ', text).strip().casefold()
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def ref_key(pdf_id: str) -> str:
+        return f"{REF_PREFIX}{pdf_id}"
+
+    @staticmethod
+    def loc_key(pdf_id: str) -> str:
+        return f"{LOC_PREFIX}{pdf_id}"
+
+    @staticmethod
+    def chunk_refs(metadata: dict) -> dict:
+        return {
+            key[len(REF_PREFIX):]: page
+            for key, page in (metadata or {}).items()
+            if key.startswith(REF_PREFIX) and isinstance(page, int) and page >= 1
+        }
+
+    @staticmethod
+    def resolve_ref(metadata: dict, allowed_pdf_ids=None):
+        refs = EmbeddingsUtils.chunk_refs(metadata)
+        for pdf_id in allowed_pdf_ids or refs:
+            if pdf_id in refs:
+                pages = [location["page"] for location in EmbeddingsUtils.chunk_locations(metadata, pdf_id)]
+                return {"pdf_id": pdf_id, "page": refs[pdf_id], "pages": pages or [refs[pdf_id]]}
+        return {"pdf_id": "N/A", "page": "N/A", "pages": []}
+
+    @staticmethod
+    def chunk_locations(metadata: dict, pdf_id: str) -> list[dict]:
+        # loc_<pdf_id> lists every occurrence in that PDF as "<file hash>:<page>:<start>:<end>"
+        # joined by ";"; older single spans are "<file hash>:<start>:<end>" on the ref_ page
+        loc = (metadata or {}).get(EmbeddingsUtils.loc_key(pdf_id))
+        ref_page = (metadata or {}).get(EmbeddingsUtils.ref_key(pdf_id))
+        if not loc or not isinstance(ref_page, int) or ref_page < 1:
+            return []
+        locations = []
+        for entry in loc.split(LOC_SEPARATOR):
+            parts = entry.split(":")
+            if len(parts) == 3:
+                parts.insert(1, ref_page)
+            file_hash, page, start, end = parts
+            locations.append({"page": int(page), "hash": file_hash, "start": int(start), "end": int(end)})
+        return sorted(locations, key=lambda location: (location["page"], location["start"]))
+
+    @staticmethod
+    def chunk_span(metadata: dict, pdf_id: str, page: int = None) -> dict:
+        # span of the occurrence on the given page, or of the first one
+        for location in EmbeddingsUtils.chunk_locations(metadata, pdf_id):
+            if page is None or location["page"] == page:
+                return {"hash": location["hash"], "start": location["start"], "end": location["end"]}
+        return {}
+
+    @staticmethod
+    def chunk_text(metadata: dict, pdf_id: str, page: int = None) -> str:
+        locations = [
+            location for location in EmbeddingsUtils.chunk_locations(metadata, pdf_id)
+            if page is None or location["page"] == page
+        ]
+        if not locations:
+            return ""
+        location = locations[0]
+        pages = PageCache.get(location["hash"])
+        if not pages or location["page"] > len(pages):
+            return ""
+        return pages[location["page"] - 1][location["start"]:location["end"]]
+
+    @staticmethod
+    def scope_filter(allowed_pdf_ids):
+        clauses = [{EmbeddingsUtils.ref_key(pdf_id): {"$gte": 1}} for pdf_id in allowed_pdf_ids]
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$or": clauses}
+
+    @staticmethod
+    def _add_ref(metadata: dict, pdf_id: str, file_hash: str, page: int, start: int, end: int) -> dict:
+        return EmbeddingsUtils._add_refs(metadata, pdf_id, file_hash, [(page, start, end)])
+
+    @staticmethod
+    def _add_refs(metadata: dict, pdf_id: str, file_hash: str, spans) -> dict:
+        # spans are (page, start, end); merged with the occurrences already recorded for the PDF
+        metadata = dict(metadata or {})
+        locations = {
+            (location["page"], location["start"]): location
+            for location in EmbeddingsUtils.chunk_locations(metadata, pdf_id)
+        }
+        for page, start, end in spans:
+            locations[(page, start)] = {"page": page, "hash": file_hash, "start": start, "end": end}
+        ordered = [locations[key] for key in sorted(locations)]
+        # ref_ keeps the first page so the scope filter stays a plain numeric comparison
+        metadata[EmbeddingsUtils.ref_key(pdf_id)] = ordered[0]["page"]
+        metadata[EmbeddingsUtils.loc_key(pdf_id)] = LOC_SEPARATOR.join(
+            f"{location['hash']}:{location['page']}:{location['start']}:{location['end']}" for location in ordered
+        )
+        return metadata
+
+    @staticmethod
+    def add_pdf_chunks(collection, pdf_id: str, file_hash: str, chunks):
+        # chunks are (chunk_id, text, page, start, end); only offsets are stored, the
+        # text itself lives once in the page store
+        unique = {}
+        for chunk_id, text, page, start, end in chunks:
+            unique.setdefault(chunk_id, (text, []))[1].append((page, start, end))
+        if not unique:
+            return
+
+        known = set(collection.get(ids=list(unique), include=[])["ids"])
+        new_ids = [chunk_id for chunk_id in unique if chunk_id not in known]
+        embeddings = dict(zip(
+            new_ids,
+            EmbeddingsUtils.embedding_function()([unique[chunk_id][0] for chunk_id in new_ids])
+        )) if new_ids else {}
+
+        with EmbeddingsUtils._refs_lock:
+            existing = collection.get(ids=list(unique), include=["metadatas"])
+            update_ids, update_metadatas = [], []
+            for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+                _, spans = unique.pop(chunk_id)
+                update_ids.append(chunk_id)
+                update_metadatas.append(EmbeddingsUtils._add_refs(metadata, pdf_id, file_hash, spans))
+            if update_ids:
+                collection.update(ids=update_ids, metadatas=update_metadatas)
+
+            # a chunk seen before the lock may have been deleted since; embed it now
+            missing = [chunk_id for chunk_id in unique if chunk_id not in embeddings]
+            if missing:
+                embeddings.update(zip(
+                    missing,
+                    EmbeddingsUtils.embedding_function()([unique[chunk_id][0] for chunk_id in missing])
+                ))
+
+            if unique:
+                collection.add(
+                    ids=list(unique),
+                    embeddings=[embeddings[chunk_id] for chunk_id in unique],
+                    metadatas=[
+                        EmbeddingsUtils._add_refs({}, pdf_id, file_hash, spans)
+                        for _, spans in unique.values()
+                    ]
+                )
+
+    @staticmethod
+    def delete_pdf_chunks(collection, pdf_id: str):
+        key = EmbeddingsUtils.ref_key(pdf_id)
+        with EmbeddingsUtils._refs_lock:
+            existing = collection.get(where={key: {"$gte": 1}}, include=["metadatas"])
+            orphan_ids, update_ids, update_metadatas = [], [], []
+            # Chroma merges metadata on update and upsert; a None value removes the key
+            removed = {key: None, EmbeddingsUtils.loc_key(pdf_id): None}
+            for chunk_id, metadata in zip(existing["ids"], existing["metadatas"]):
+                remaining = {k: v for k, v in (metadata or {}).items() if k not in removed}
+                if EmbeddingsUtils.chunk_refs(remaining):
+                    update_ids.append(chunk_id)
+                    update_metadatas.append(removed)
+                else:
+                    orphan_ids.append(chunk_id)
+            if update_ids:
+                collection.update(ids=update_ids, metadatas=update_metadatas)
+            if orphan_ids:
+                collection.delete(ids=orphan_ids)
+
+    @staticmethod
+    def query_partitions(store, embedding, allowed_pdf_ids=None, n_results=5):
+        return EmbeddingsUtils.query_partitions_batch(store, [embedding], allowed_pdf_ids, n_results)[0]
+
+    @staticmethod
+    def query_partitions_batch(store, embeddings, allowed_pdf_ids=None, n_results=5):
+        # only the partitions holding the scoped PDFs are searched, with every query
+        # embedding in one call; each returns its own nearest n_results per query and
+        # the merged lists keep the overall nearest
+        if allowed_pdf_ids is not None:
+            # small scopes are answered exactly from an in-memory matrix once it is loaded
+            hits = store.scope_index.search(store, embeddings, allowed_pdf_ids, n_results)
+            if hits is not None:
+                return hits
+
+        if allowed_pdf_ids is None:
+            targets = [(collection, None) for collection in store.all_partitions()]
+        else:
+            targets = [
+                (collection, EmbeddingsUtils.scope_filter(pdf_ids))
+                for collection, pdf_ids in store.partitions_for(allowed_pdf_ids)
+            ]
+
+        hits = [[] for _ in embeddings]
+        for collection, where in targets:
             results = collection.query(
-                query_texts=[user_message],
+                query_embeddings=list(embeddings),
                 n_results=n_results,
-                where={"pdf_id": {"$in": allowed_pdf_ids}}
+                where=where,
+                include=["metadatas", "distances"]
+            )
+            for i, query_hits in enumerate(hits):
+                query_hits.extend(zip(results["distances"][i], results["ids"][i], results["metadatas"][i]))
+
+        merged_hits = []
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[0])
+            # a chunk shared by PDFs in different partitions is stored in each of them
+            merged, seen = [], set()
+            for distance, chunk_id, metadata in query_hits:
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                merged.append((distance, metadata))
+                if len(merged) == n_results:
+                    break
+            merged_hits.append(merged)
+        return merged_hits
+
+    @staticmethod
+    def query_pdf_chunks(store, user_message, allowed_pdf_ids, n_results=5):
+        try:
+            hits = EmbeddingsUtils.query_partitions(
+                store, EmbeddingsUtils.embed_query(user_message), allowed_pdf_ids, n_results
             )
             filtered_results = {
                 "documents": [[]],
                 "metadatas": [[]],
                 "distances": [[]]
             }
-            for i, distance in enumerate(results["distances"][0]):
-                if distance < 1.5:
-                    filtered_results["documents"][0].append(results["documents"][0][i])
-                    filtered_results["metadatas"][0].append(results["metadatas"][0][i])
+            for distance, metadata in hits:
+                if distance < store.max_distance:
+                    ref = EmbeddingsUtils.resolve_ref(metadata, allowed_pdf_ids)
+                    filtered_results["documents"][0].append(EmbeddingsUtils.chunk_text(metadata, ref["pdf_id"]))
+                    filtered_results["metadatas"][0].append({**ref, **EmbeddingsUtils.chunk_span(metadata, ref["pdf_id"])})
                     filtered_results["distances"][0].append(distance)
             return filtered_results
         except Exception as e:
-            return None
\ No newline at end of file
+            return None
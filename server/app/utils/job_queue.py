@@ -0,0 +1,135 @@
+import os
+import time
+import uuid
+import heapq
+import itertools
+import threading
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SIMILARITY = 1
+PRIORITY_INGEST = 2
+PRIORITY_BACKGROUND = 3
+
+FINISHED_JOB_TTL = 3600
+
+class QueueFullError(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind: str, priority: int, target, args: tuple):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.target = target
+        self.args = args
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: float = None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job {self.id} did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def to_dict(self, position: int = None) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "position": position,
+            "progress": round(self.progress, 3),
+            "error": str(self.error) if self.error is not None else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobQueue:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self._workers = []
+        self.max_workers = 0
+        self.max_depth = 0
+
+    def init_app(self, app):
+        self.max_workers = app.config.get("JOB_WORKERS") or max(1, (os.cpu_count() or 2) - 1)
+        self.max_depth = app.config.get("JOB_QUEUE_MAX_DEPTH", 100)
+        with self._cond:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, kind: str, target, *args, priority: int = PRIORITY_INGEST) -> Job:
+        job = Job(kind, priority, target, args)
+        with self._cond:
+            self._prune()
+            if priority > PRIORITY_INTERACTIVE and len(self._heap) >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({len(self._heap)} pending)")
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+        return job
+
+    def is_full(self) -> bool:
+        with self._cond:
+            return len(self._heap) >= self.max_depth
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int | None:
+        with self._cond:
+            if job.status != "queued":
+                return None
+            key = next(((p, s) for p, s, j in self._heap if j is job), None)
+            if key is None:
+                return None
+            return sum(1 for p, s, _ in self._heap if (p, s) < key)
+
+    def report_progress(self, fraction: float):
+        job = getattr(self._local, "job", None)
+        if job is not None:
+            job.progress = min(max(fraction, 0.0), 1.0)
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_TTL
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                job.status = "running"
+                job.started_at = time.time()
+
+            self._local.job = job
+            try:
+                job.result = job.target(*job.args)
+                job.status = "done"
+                job.progress = 1.0
+            except Exception as e:
+                job.error = e
+                job.status = "failed"
+            finally:
+                self._local.job = None
+                job.finished_at = time.time()
+                job._done.set()
@@ -0,0 +1,169 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+LLM_KEY_BACKOFF_BASE = float(os.getenv("LLM_KEY_BACKOFF_BASE", 5))
+LLM_KEY_BACKOFF_MAX = float(os.getenv("LLM_KEY_BACKOFF_MAX", 300))
+LLM_KEY_AUTH_COOLDOWN = float(os.getenv("LLM_KEY_AUTH_COOLDOWN", 3600))
+
+RATE_LIMITED = 429
+# unauthorized, out of credit, forbidden: the key is unusable until someone fixes it
+KEY_REJECTED = (401, 402, 403)
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value) -> float | None:
+    # "20", "1m30.5s", "7.66s", "250ms"
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+def retry_after(headers) -> float | None:
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        milliseconds = parse_duration(headers.get("retry-after-ms"))
+        if milliseconds is not None:
+            return milliseconds / 1000
+    value = headers.get("retry-after")
+    if value:
+        seconds = parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    resets = [
+        parse_duration(headers.get(name))
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens", "x-ratelimit-reset")
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+class KeyState:
+    def __init__(self):
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.remaining_requests = None
+        self.last_error = None
+
+class KeyScheduler:
+    # orders a group's keys healthiest first: keys out of cooldown before cooling ones,
+    # then fewest requests in flight, most rate-limit headroom, least recently used
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @staticmethod
+    def fingerprint(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+    def _state(self, api_key: str) -> KeyState:
+        state = self._states.get(api_key)
+        if state is None:
+            state = self._states[api_key] = KeyState()
+        return state
+
+    def order(self, api_keys) -> list[str]:
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key in dict.fromkeys(api_keys) if key]
+            states = {key: self._state(key) for key in keys}
+
+        def rank(key):
+            state = states[key]
+            if state.cooldown_until > now:
+                return (1, state.cooldown_until, 0, 0)
+            headroom = -state.remaining_requests if state.remaining_requests is not None else 0
+            return (0, state.in_flight, headroom, state.last_used)
+
+        return sorted(keys, key=rank)
+
+    @contextmanager
+    def use(self, api_key: str):
+        with self._lock:
+            state = self._state(api_key)
+            state.in_flight += 1
+            state.last_used = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                state.in_flight -= 1
+
+    def record_success(self, api_key: str, headers=None):
+        remaining = None
+        if headers and headers.get("x-ratelimit-remaining-requests") is not None:
+            try:
+                remaining = int(float(headers.get("x-ratelimit-remaining-requests")))
+            except ValueError:
+                remaining = None
+        with self._lock:
+            state = self._state(api_key)
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.remaining_requests = remaining
+            if remaining == 0:
+                wait = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if wait:
+                    state.cooldown_until = time.monotonic() + wait
+
+    def record_failure(self, api_key: str, error: Exception) -> bool:
+        # returns True when the failure belongs to the key and another key should be tried
+        status = getattr(error, "status_code", None)
+        if status != RATE_LIMITED and status not in KEY_REJECTED:
+            return False
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        with self._lock:
+            state = self._state(api_key)
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = f"{status}: {str(error)[:200]}"
+            if status == RATE_LIMITED:
+                wait = retry_after(headers)
+                if wait is None:
+                    wait = min(LLM_KEY_BACKOFF_BASE * 2 ** (state.consecutive_failures - 1), LLM_KEY_BACKOFF_MAX)
+            else:
+                wait = LLM_KEY_AUTH_COOLDOWN
+            state.cooldown_until = time.monotonic() + wait
+        return True
+
+    def state(self, groups: dict) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for group, api_keys in groups.items():
+                result[group] = []
+                for api_key in dict.fromkeys(key for key in api_keys if key):
+                    state = self._state(api_key)
+                    result[group].append({
+                        "key": self.fingerprint(api_key),
+                        "available": state.cooldown_until <= now,
+                        "cooldown_remaining": round(max(state.cooldown_until - now, 0), 1),
+                        "in_flight": state.in_flight,
+                        "successes": state.successes,
+                        "failures": state.failures,
+                        "consecutive_failures": state.consecutive_failures,
+                        "remaining_requests": state.remaining_requests,
+                        "last_error": state.last_error
+                    })
+            return result
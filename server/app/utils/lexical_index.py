@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from app.utils.page_cache import PageCache
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "./lexical_index")
+LEXICAL_INDEX_CACHE_SIZE = int(os.getenv("LEXICAL_INDEX_CACHE_SIZE", 64))
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# keeps codes like "E-1042", "v2.3.1" or "H2SO4" whole; their parts are indexed as well
+TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+PART_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in TOKEN_RE.finditer(text.casefold()):
+        token = match.group()
+        tokens.append(token)
+        parts = PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+class PdfIndex:
+    def __init__(self, chunks: list, postings: dict):
+        # chunks are [page, start, end, length]; postings map term -> [[chunk index, tf], ...]
+        self.chunks = chunks
+        self.postings = postings
+        self.total_length = sum(chunk[3] for chunk in chunks)
+
+class LexicalIndexWriter:
+    def __init__(self):
+        self.chunks = []
+        self.postings = {}
+
+    def add(self, page: int, start: int, end: int, text: str):
+        tokens = tokenize(text)
+        index = len(self.chunks)
+        self.chunks.append([page, start, end, len(tokens)])
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, []).append([index, tf])
+
+class LexicalIndex:
+    _lock = threading.Lock()
+    _entries: "OrderedDict[str, PdfIndex]" = OrderedDict()
+
+    @staticmethod
+    def _path(file_hash: str) -> str:
+        return os.path.join(LEXICAL_INDEX_DIR, f"{file_hash}.json")
+
+    @staticmethod
+    def _remember(file_hash: str, index: PdfIndex):
+        with LexicalIndex._lock:
+            LexicalIndex._entries[file_hash] = index
+            LexicalIndex._entries.move_to_end(file_hash)
+            while len(LexicalIndex._entries) > LEXICAL_INDEX_CACHE_SIZE:
+                LexicalIndex._entries.popitem(last=False)
+
+    @staticmethod
+    def get(file_hash: str) -> PdfIndex | None:
+        with LexicalIndex._lock:
+            index = LexicalIndex._entries.get(file_hash)
+            if index is not None:
+                LexicalIndex._entries.move_to_end(file_hash)
+                return index
+
+        path = LexicalIndex._path(file_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        index = PdfIndex(data["chunks"], data["postings"])
+        LexicalIndex._remember(file_hash, index)
+        return index
+
+    @staticmethod
+    @contextmanager
+    def writer(file_hash: str):
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        path = LexicalIndex._path(file_hash)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        writer = LexicalIndexWriter()
+        yield writer
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": writer.chunks, "postings": writer.postings}, f)
+        os.replace(tmp_path, path)
+        LexicalIndex._remember(file_hash, PdfIndex(writer.chunks, writer.postings))
+
+    @staticmethod
+    def evict(file_hash: str):
+        with LexicalIndex._lock:
+            LexicalIndex._entries.pop(file_hash, None)
+        path = LexicalIndex._path(file_hash)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def search(scope, query: str, n_results: int = 5) -> list[dict]:
+        # scope is [(pdf_id, file_hash)]; BM25 statistics are taken over the whole scope so
+        # scores from different PDFs are comparable
+        indexes, seen = [], set()
+        for pdf_id, file_hash in scope:
+            if not file_hash or file_hash in seen:
+                continue
+            seen.add(file_hash)
+            index = LexicalIndex.get(file_hash)
+            if index is not None and index.chunks:
+                indexes.append((pdf_id, file_hash, index))
+        terms = set(tokenize(query))
+        if not indexes or not terms:
+            return []
+
+        chunk_count = sum(len(index.chunks) for _, _, index in indexes)
+        avg_length = sum(index.total_length for _, _, index in indexes) / chunk_count or 1
+        scores = Counter()
+        for term in terms:
+            df = sum(len(index.postings.get(term, ())) for _, _, index in indexes)
+            if not df:
+                continue
+            idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+            for position, (_, _, index) in enumerate(indexes):
+                for chunk_index, tf in index.postings.get(term, ()):
+                    length = index.chunks[chunk_index][3]
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[(position, chunk_index)] += idf * tf * (BM25_K1 + 1) / norm
+
+        hits = []
+        for (position, chunk_index), score in heapq.nlargest(n_results, scores.items(), key=lambda item: item[1]):
+            pdf_id, file_hash, index = indexes[position]
+            page, start, end, _ = index.chunks[chunk_index]
+            pages = PageCache.get(file_hash)
+            if not pages or page > len(pages):
+                continue
+            hits.append({
+                "pdf_id": pdf_id,
+                "page": page,
+                "hash": file_hash,
+                "start": start,
+                "end": end,
+                "text": pages[page - 1][start:end],
+                "score": score
+            })
+        return hits
+
+    @staticmethod
+    def fuse(rankings, k: int = RRF_K) -> list:
+        # reciprocal-rank fusion over lists of keys, best first
+        scores = Counter()
+        for ranking in rankings:
+            for rank, key in enumerate(ranking, start=1):
+                scores[key] += 1 / (k + rank)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
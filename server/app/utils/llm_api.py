@@ -1,14 +1,16 @@
-
 import os
-from openai import OpenAI
-from openai.types.chat import ChatCompletion
-from typing import List, Dict
-from app.extensions import mongo
+import itertools
+from typing import List, Dict, Iterator, TYPE_CHECKING
+from app.extensions import mongo, key_scheduler, completion_cache
 from app.utils.pdf_preprocess import PDFUtils
+from app.utils.llm_clients import LLMClientPool
 from bson import ObjectId
 from dotenv import load_dotenv
 load_dotenv() 
 
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
 API_KEYS = {
     "llama": [
         os.getenv("LLY_GROQ_LLAMA"),
@@ -28,6 +30,11 @@ API_KEYS = {
     ],
 }
 
+SUMMARY_API_KEYS = [
+    os.getenv("HUIYEE2_GEMINI_API_KEY"),
+    os.getenv("WUKANG2_GEMINI_API_KEY")
+]
+
 BASE_URLS = {
     "llama": "https://api.groq.com/openai/v1",
     "gemini": "https://generativelanguage.googleapis.com/v1beta/openai/",
@@ -199,7 +206,8 @@ class LLMApi:
         return prompt
 
     @staticmethod
-    def send_message(model_name: str, history: List[Dict[str, str]]) -> str:
+    def send_message(model_name: str, history: List[Dict[str, str]], timeout: float = None, semantic: dict = None) -> str:
+        # semantic = {"query": user message, "scope": pdf ids} lets a near-identical question reuse an answer
         group = MODEL_GROUPS.get(model_name)
         if not group:
             raise ValueError(f"Unknown model name: {model_name}")
@@ -210,29 +218,120 @@ class LLMApi:
         # if history:
         #     history[-1]['content'] = history[-1].get('content', '') + TRAILING_MESSAGE
 
-        print("\n\n\n=== Conversation History ===")
-        for i, msg in enumerate(history):
-            role = msg.get("role", "unknown").upper()
-            content = msg.get("content", "")
-            print(f"{i+1}. [{role}]")
-            print(f"{'-' * 10}\n{content}\n")
+        LLMApi._print_history(history)
+
+        key, embedding, cached = LLMApi._cache_lookup(model_name, history, semantic)
+        if cached is not None:
+            return cached
 
-        for api_key in api_keys:
+        response = LLMApi._complete(
+            base_url, api_keys,
+            model=model_name,
+            messages=history,
+            timeout=LLMClientPool.timeout(timeout)
+        )
+        if response is None:
+            raise RuntimeError(f"All API keys exhausted for model group '{group}'.")
+        content = response.choices[0].message.content
+        LLMApi._cache_store(key, model_name, content, history, semantic, embedding)
+        return content
+
+    @staticmethod
+    def _cache_lookup(model_name: str, history: List[Dict[str, str]], semantic: dict = None):
+        key = completion_cache.key(model_name, history)
+        cached = completion_cache.get(key)
+        if cached is not None:
+            completion_cache.record(True)
+            return key, None, cached
+
+        embedding = None
+        if semantic and completion_cache.enabled and completion_cache.semantic:
+            from app.utils.embeddings import EmbeddingsUtils
+            embedding = EmbeddingsUtils.embed_query(semantic["query"])
+            cached = completion_cache.find_similar(model_name, semantic["scope"], history, embedding)
+            if cached is not None:
+                completion_cache.record(True, semantic=True)
+                return key, embedding, cached
+        completion_cache.record(False)
+        return key, embedding, None
+
+    @staticmethod
+    def _cache_store(key: str, model_name: str, content: str, history: List[Dict[str, str]], semantic: dict = None, embedding=None):
+        scope = semantic["scope"] if semantic and embedding is not None else None
+        completion_cache.put(key, model_name, content, history, scope=scope, embedding=embedding)
+
+    @staticmethod
+    def _complete(base_url: str, api_keys: List[str], **kwargs) -> "ChatCompletion | None":
+        # keys are tried healthiest first; only rate-limit and rejected-key errors move on
+        for api_key in key_scheduler.order(api_keys):
+            client = LLMClientPool.get(base_url, api_key)
             try:
-                client = OpenAI(api_key=api_key, base_url=base_url)
-                response: ChatCompletion = client.chat.completions.create(
-                    model=model_name,
-                    messages=history,
-                )
-                return response.choices[0].message.content
+                with key_scheduler.use(api_key):
+                    raw = client.chat.completions.with_raw_response.create(**kwargs)
             except Exception as e:
-                error_msg = str(e).lower()
-                if "quota" in error_msg or "limit" in error_msg or "unauthorized" in error_msg:
+                if key_scheduler.record_failure(api_key, e):
                     continue
-                else:
+                raise e
+            key_scheduler.record_success(api_key, raw.headers)
+            return raw.parse()
+        return None
+
+    @staticmethod
+    def stream_message(model_name: str, history: List[Dict[str, str]], timeout: float = None, semantic: dict = None) -> Iterator[str]:
+        group = MODEL_GROUPS.get(model_name)
+        if not group:
+            raise ValueError(f"Unknown model name: {model_name}")
+
+        base_url = BASE_URLS[group]
+        api_keys = API_KEYS[group]
+
+        LLMApi._print_history(history)
+
+        key, embedding, cached = LLMApi._cache_lookup(model_name, history, semantic)
+        if cached is not None:
+            yield cached
+            return
+
+        for api_key in key_scheduler.order(api_keys):
+            client = LLMClientPool.get(base_url, api_key)
+            with key_scheduler.use(api_key):
+                try:
+                    raw = client.chat.completions.with_raw_response.create(
+                        model=model_name,
+                        messages=history,
+                        stream=True,
+                        timeout=LLMClientPool.timeout(timeout)
+                    )
+                    chunks = iter(raw.parse())
+                    # the next key is only tried while nothing has been sent to the caller yet
+                    first = next(chunks, None)
+                except Exception as e:
+                    if key_scheduler.record_failure(api_key, e):
+                        continue
                     raise e
+                key_scheduler.record_success(api_key, raw.headers)
+
+                if first is None:
+                    return
+                parts = []
+                for chunk in itertools.chain([first], chunks):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                # only a stream that ran to the end is cached
+                LLMApi._cache_store(key, model_name, "".join(parts), history, semantic, embedding)
+                return
         raise RuntimeError(f"All API keys exhausted for model group '{group}'.")
 
+    @staticmethod
+    def _print_history(history: List[Dict[str, str]]):
+        print("\n\n\n=== Conversation History ===")
+        for i, msg in enumerate(history):
+            role = msg.get("role", "unknown").upper()
+            content = msg.get("content", "")
+            print(f"{i+1}. [{role}]")
+            print(f"{'-' * 10}\n{content}\n")
+
     @staticmethod
     def get_conversation_history(conversation_id: str):
         try:
@@ -246,39 +345,34 @@ class LLMApi:
         return conv.get("history", [])
 
     @staticmethod
-    def summarize_pdf_with_gemini(file_path: str) -> str:
-        gemini_keys = [
-            os.getenv("HUIYEE2_GEMINI_API_KEY"),
-            os.getenv("WUKANG2_GEMINI_API_KEY")
-        ]
-        base_url = "https://generativelanguage.googleapis.com/v1beta/openai/"
+    def summarize_pdf_with_gemini(file_path: str, file_hash: str = None) -> str:
+        base_url = BASE_URLS["gemini"]
         model = "gemini-2.0-flash"
 
-        pdf_info = PDFUtils.extract_information(file_path)
-        all_text = "\n".join(chunk for page in pdf_info for chunk in page["chunks"])
+        all_text = "\n".join(PDFUtils.get_pdf_content(file_path, file_hash))
         cleaned_text = PDFUtils.remove_stopwords(all_text)
 
-        for api_key in gemini_keys:
-            try:
-                client = OpenAI(api_key=api_key, base_url=base_url)
-                response: ChatCompletion = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Summarize the input text clearly and directly in markdown format, without introductory or closing phrases."
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Summarize this:\n{cleaned_text}"
-                        }
-                    ]
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                error_msg = str(e).lower()
-                if "quota" in error_msg or "limit" in error_msg or "unauthorized" in error_msg:
-                    continue
-                else:
-                    raise e
-        raise RuntimeError("All Gemini keys exhausted or failed.")
\ No newline at end of file
+        messages = [
+            {
+                "role": "system",
+                "content": "Summarize the input text clearly and directly in markdown format, without introductory or closing phrases."
+            },
+            {
+                "role": "user",
+                "content": f"Summarize this:\n{cleaned_text}"
+            }
+        ]
+        key, _, cached = LLMApi._cache_lookup(model, messages)
+        if cached is not None:
+            return cached
+
+        response = LLMApi._complete(
+            base_url, SUMMARY_API_KEYS,
+            model=model,
+            messages=messages
+        )
+        if response is None:
+            raise RuntimeError("All Gemini keys exhausted or failed.")
+        content = response.choices[0].message.content
+        LLMApi._cache_store(key, model, content, messages)
+        return content
\ No newline at end of file
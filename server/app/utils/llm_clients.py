@@ -0,0 +1,69 @@
+import os
+import threading
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+
+def _no_retry_on_rate_limit(response):
+    # the SDK would sleep and retry a 429 on the same key; the key scheduler moves to the next key instead
+    if response.status_code == 429:
+        response.headers["x-should-retry"] = "false"
+
+class LLMClientPool:
+    # one OpenAI client per (base_url, api_key), all sharing a keep-alive connection pool;
+    # built lazily and rebuilt after a fork so each worker owns its sockets
+    _lock = threading.Lock()
+    _clients = {}
+    _http_client = None
+    _pid = None
+
+    @staticmethod
+    def timeout(read: float = None):
+        import httpx
+        return httpx.Timeout(LLM_READ_TIMEOUT if read is None else read, connect=LLM_CONNECT_TIMEOUT)
+
+    @staticmethod
+    def _http():
+        import httpx
+        if LLMClientPool._http_client is None or LLMClientPool._pid != os.getpid():
+            LLMClientPool._clients = {}
+            LLMClientPool._pid = os.getpid()
+            LLMClientPool._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=LLMClientPool.timeout(),
+                event_hooks={"response": [_no_retry_on_rate_limit]}
+            )
+        return LLMClientPool._http_client
+
+    @staticmethod
+    def get(base_url: str, api_key: str):
+        with LLMClientPool._lock:
+            http_client = LLMClientPool._http()
+            client = LLMClientPool._clients.get((base_url, api_key))
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=http_client,
+                    timeout=LLMClientPool.timeout(),
+                    max_retries=LLM_MAX_RETRIES
+                )
+                LLMClientPool._clients[(base_url, api_key)] = client
+            return client
+
+    @staticmethod
+    def close():
+        with LLMClientPool._lock:
+            if LLMClientPool._http_client is not None and LLMClientPool._pid == os.getpid():
+                LLMClientPool._http_client.close()
+            LLMClientPool._http_client = None
+            LLMClientPool._clients = {}
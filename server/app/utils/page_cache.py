@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "./page_cache")
+PAGE_CACHE_MAX_CHARS = int(os.getenv("PAGE_CACHE_MAX_CHARS", 50_000_000))
+
+class PageWriter:
+    def __init__(self, f):
+        self._f = f
+        self.page_count = 0
+
+    def append(self, text: str):
+        self._f.write(json.dumps(text))
+        self._f.write("\n")
+        self.page_count += 1
+
+class PageCache:
+    _lock = threading.Lock()
+    _entries: "OrderedDict[str, list[str]]" = OrderedDict()
+    _size = 0
+
+    @staticmethod
+    def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _path(file_hash: str) -> str:
+        return os.path.join(PAGE_CACHE_DIR, f"{file_hash}.jsonl")
+
+    @staticmethod
+    def _remember(file_hash: str, pages: list[str]):
+        size = sum(len(text) for text in pages)
+        if size > PAGE_CACHE_MAX_CHARS:
+            return
+        with PageCache._lock:
+            old = PageCache._entries.pop(file_hash, None)
+            if old is not None:
+                PageCache._size -= sum(len(text) for text in old)
+            PageCache._entries[file_hash] = pages
+            PageCache._size += size
+            while PageCache._size > PAGE_CACHE_MAX_CHARS and PageCache._entries:
+                _, evicted = PageCache._entries.popitem(last=False)
+                PageCache._size -= sum(len(text) for text in evicted)
+
+    @staticmethod
+    def get(file_hash: str) -> list[str] | None:
+        with PageCache._lock:
+            pages = PageCache._entries.get(file_hash)
+            if pages is not None:
+                PageCache._entries.move_to_end(file_hash)
+                return pages
+
+        path = PageCache._path(file_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                pages = [json.loads(line) for line in f]
+        except (OSError, ValueError):
+            return None
+        PageCache._remember(file_hash, pages)
+        return pages
+
+    @staticmethod
+    def put(file_hash: str, pages: list[str]):
+        with PageCache.writer(file_hash) as page_store:
+            for text in pages:
+                page_store.append(text)
+        PageCache._remember(file_hash, pages)
+
+    @staticmethod
+    @contextmanager
+    def writer(file_hash: str):
+        os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+        path = PageCache._path(file_hash)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                yield PageWriter(f)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def evict(file_hash: str):
+        with PageCache._lock:
+            pages = PageCache._entries.pop(file_hash, None)
+            if pages is not None:
+                PageCache._size -= sum(len(text) for text in pages)
+        path = PageCache._path(file_hash)
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,36 +1,111 @@
 import os
 import re
-import fitz
 import time
-import spacy
-import subprocess
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from importlib.util import find_spec as is_package
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from itertools import combinations
+from app.utils.page_cache import PageCache
+from app.utils.embeddings import EmbeddingsUtils
 
-def load_spacy_model(model_name="en_core_web_sm"):
-    if not is_package(model_name):
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+SPACY_BATCH_SIZE = 64
+
+# stop-word removal only needs the tokenizer and the lexeme is_stop flags
+SPACY_DISABLED_PIPES = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner", "senter"]
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def load_spacy_model(model_name=SPACY_MODEL):
+    import spacy
+    if is_package(model_name):
         try:
-            spacy.load(model_name)
+            return spacy.load(model_name, exclude=SPACY_DISABLED_PIPES)
         except OSError:
-            print(f"Downloading spaCy model: {model_name}")
-            subprocess.run(["python", "-m", "spacy", "download", model_name], check=True)
-    return spacy.load(model_name)
+            pass
+    print(f"spaCy model '{model_name}' not available, falling back to a blank English tokenizer")
+    return spacy.blank("en")
+
+def get_nlp():
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                _nlp = load_spacy_model()
+    return _nlp
+
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PARALLEL_PAGE_THRESHOLD", 150))
+PARALLEL_SHARD_PAGES = int(os.getenv("PARALLEL_SHARD_PAGES", 50))
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", 0)) or os.cpu_count()
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 256))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn, not fork: the server process is multi-threaded. Spawned workers only
+            # need the module-level functions below and re-import the main module as
+            # __mp_main__, which is why run.py does not build the app under that name
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
 
-nlp = load_spacy_model("en_core_web_sm")
+def _page_shards(page_count):
+    return [(start, min(start + PARALLEL_SHARD_PAGES, page_count))
+            for start in range(0, page_count, PARALLEL_SHARD_PAGES)]
+
+def _extract_page_range(pdf_path, start, end):
+    import fitz
+    content = []
+    with fitz.open(pdf_path) as pdf:
+        for page_num in range(start, end):
+            content.append(PDFUtils.clean_page_text(pdf[page_num].get_text("text")))
+    return content
+
+def _extract_and_chunk_range(pdf_path, start, end):
+    return [(text, PDFUtils.get_chunk_spans(text)) for text in _extract_page_range(pdf_path, start, end)]
+
+def _iter_shards(fn, pdf_path, page_count):
+    # keep only a bounded window of shards in flight so memory stays flat
+    pool = get_process_pool()
+    shards = iter(_page_shards(page_count))
+    pending = deque()
+    for start, end in shards:
+        pending.append(pool.submit(fn, pdf_path, start, end))
+        if len(pending) >= PARALLEL_WORKERS * 2:
+            break
+    while pending:
+        results = pending.popleft().result()
+        next_shard = next(shards, None)
+        if next_shard:
+            pending.append(pool.submit(fn, pdf_path, *next_shard))
+        yield from results
+
+def remove_stopwords_batch(texts):
+    nlp = get_nlp()
+    return [
+        " ".join(token.text for token in doc if not token.is_stop)
+        for doc in nlp.pipe(texts, batch_size=SPACY_BATCH_SIZE)
+    ]
 
 def remove_stopwords(text):
-    doc = nlp(text)
-    tokens = [token.text for token in doc if not token.is_stop]
-    return " ".join(tokens)
+    # piping line by line keeps each doc small and under nlp.max_length
+    return "\n".join(remove_stopwords_batch(text.split("\n")))
 
 class PDFUtils:
     @staticmethod
-    def count_words_pdf(file_path):
+    def count_words_pages(content: list[str]) -> int:
         total_words = 0
-        content = PDFUtils.get_pdf_content(file_path)
         for text in content:
             words = text.split()
             total_words += len(words)
@@ -55,79 +130,125 @@ class PDFUtils:
     @staticmethod
     def remove_stopwords(text):
         return remove_stopwords(text)
+
+    @staticmethod
+    def remove_stopwords_batch(texts):
+        return remove_stopwords_batch(texts)
         
     @staticmethod
-    def get_pdf_content(pdf_path):
-        content = []
-        with fitz.open(pdf_path) as pdf:
-            for page in pdf:
-                text = page.get_text("text")
-                text = PDFUtils.remove_non_ascii(text)
-                text = PDFUtils.remove_extra_space(text)
-                content.append(text)
+    def get_pdf_content(pdf_path, file_hash=None):
+        if file_hash is None:
+            file_hash = PageCache.hash_file(pdf_path)
+        content = PageCache.get(file_hash)
+        if content is None:
+            content = PDFUtils.parse_pdf_content(pdf_path)
+            PageCache.put(file_hash, content)
         return content
 
+    @staticmethod
+    def clean_page_text(text):
+        text = PDFUtils.remove_non_ascii(text)
+        return PDFUtils.remove_extra_space(text)
+
+    @staticmethod
+    def count_pages(pdf_path):
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            return pdf.page_count
+
+    @staticmethod
+    def parse_pdf_content(pdf_path):
+        return list(PDFUtils.iter_pdf_content(pdf_path))
+
+    @staticmethod
+    def iter_pdf_content(pdf_path):
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            page_count = pdf.page_count
+            if page_count < PARALLEL_PAGE_THRESHOLD:
+                for page in pdf:
+                    yield PDFUtils.clean_page_text(page.get_text("text"))
+                return
+        yield from _iter_shards(_extract_page_range, pdf_path, page_count)
+
+    @staticmethod
+    def iter_information(pdf_path):
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            page_count = pdf.page_count
+            if page_count < PARALLEL_PAGE_THRESHOLD:
+                for page_num, page in enumerate(pdf, start=1):
+                    text = PDFUtils.clean_page_text(page.get_text("text"))
+                    yield {"page": page_num, "text": text, "spans": PDFUtils.get_chunk_spans(text)}
+                return
+        pages = _iter_shards(_extract_and_chunk_range, pdf_path, page_count)
+        for page_num, (text, spans) in enumerate(pages, start=1):
+            yield {"page": page_num, "text": text, "spans": spans}
+
     @staticmethod
     def get_text_chunks(text: str):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             length_function=len
         )
         return text_splitter.split_text(text)
 
     @staticmethod
-    def extract_information(file_path: str):
-        pdf_info = []
-        content = PDFUtils.get_pdf_content(file_path)
-        for page_num, text in enumerate(content,  start=1):
-            chunks = PDFUtils.get_text_chunks(text)
-            pdf_info.append({"page":page_num,"chunks":chunks})
-        return pdf_info
-
+    def get_chunk_spans(text: str):
+        spans = []
+        start, previous_len = 0, 0
+        for chunk in PDFUtils.get_text_chunks(text):
+            offset = max(0, start + previous_len - CHUNK_OVERLAP)
+            start = text.find(chunk, offset)
+            if start < 0:
+                start = text.find(chunk)
+            spans.append((start, start + len(chunk)))
+            previous_len = len(chunk)
+        return spans
 
     @staticmethod
-    def store_pdf_chunks_to_chroma(pdf_id: str, pdf_info: list, pdf_chunks_collection):
-        documents = []
-        metadatas = []
-        ids = []
-
+    def store_pdf_chunks_to_chroma(pdf_id: str, file_hash: str, pdf_info, pdf_chunks_collection, batch_size: int = CHROMA_BATCH_SIZE, lexical_index=None):
+        batch = []
         chunk_counter = 0
         for page_data in pdf_info:
             page = page_data["page"]
-            chunks = page_data["chunks"]
+            text = page_data["text"]
 
-            for chunk in chunks:
+            for start, end in page_data["spans"]:
+                chunk = text[start:end]
                 if len(chunk.split()) < 5:
                     continue
-                documents.append(chunk)
-                metadatas.append({"pdf_id": pdf_id, "page": page})
-                ids.append(f"{pdf_id}_{chunk_counter}")
+                batch.append((EmbeddingsUtils.chunk_id(chunk), chunk, page, start, end))
+                if lexical_index is not None:
+                    lexical_index.add(page, start, end, chunk)
                 chunk_counter += 1
-
-        if documents:
-            pdf_chunks_collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
+                if len(batch) >= batch_size:
+                    EmbeddingsUtils.add_pdf_chunks(pdf_chunks_collection, pdf_id, file_hash, batch)
+                    batch.clear()
+        EmbeddingsUtils.add_pdf_chunks(pdf_chunks_collection, pdf_id, file_hash, batch)
+        return chunk_counter
 
     @staticmethod
-    def compute_similarity(pdf_path1: str, pdf_path2: str) -> float:
-        text1_pages = PDFUtils.get_pdf_content(pdf_path1)
-        text2_pages = PDFUtils.get_pdf_content(pdf_path2)
-        text1 = " ".join(text1_pages)
-        text2 = " ".join(text2_pages)
+    def compute_text_similarity(text1: str, text2: str) -> float:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
         vectorizer = TfidfVectorizer()
         tfidf_matrix = vectorizer.fit_transform([text1, text2])
         similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
         return similarity
 
     @staticmethod
-    def compute_pdf_similarity_summaries(pdf_list: list[str]) -> list[dict]:
+    def compute_pdf_similarity_summaries(pdf_list: list[str], pdf_hashes: list[str] = None) -> list[dict]:
+        pdf_hashes = pdf_hashes or [None] * len(pdf_list)
+        texts = {
+            path: " ".join(PDFUtils.get_pdf_content(path, file_hash))
+            for path, file_hash in zip(pdf_list, pdf_hashes)
+        }
         pairwise_scores = []
         for p1, p2 in combinations(pdf_list, 2):
-            score = PDFUtils.compute_similarity(p1, p2)
+            score = PDFUtils.compute_text_similarity(texts[p1], texts[p2])
             name1 = os.path.splitext(os.path.basename(p1))[0]
             name2 = os.path.splitext(os.path.basename(p2))[0]
             pairwise_scores.append({
@@ -0,0 +1,60 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 512))
+
+class RetrievalCache:
+    def __init__(self, max_size: int = RETRIEVAL_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str, allowed_pdf_ids, n_results: int, mode: str = "hybrid") -> tuple:
+        normalized = re.sub(r'\s+', ' ', query).strip()
+        return (normalized, tuple(sorted(allowed_pdf_ids)), n_results, mode)
+
+    def get_or_compute(self, key: tuple, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        if value is None:
+            return None
+
+        with self._lock:
+            # an ingest or delete landed while we were searching; the result may be stale
+            if generation == self._generation:
+                self._entries[key] = value
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate_pdf(self, pdf_id: str):
+        pdf_id = str(pdf_id)
+        with self._lock:
+            self._generation += 1
+            stale = [key for key in self._entries if pdf_id in key[1]]
+            for key in stale:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
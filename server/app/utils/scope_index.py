@@ -0,0 +1,254 @@
+import os
+import threading
+from collections import OrderedDict
+
+SCOPE_INDEX_MAX_CHUNKS = int(os.getenv("SCOPE_INDEX_MAX_CHUNKS", 20000))
+SCOPE_INDEX_MAX_VECTORS = int(os.getenv("SCOPE_INDEX_MAX_VECTORS", 200000))
+SCOPE_INDEX_PRECISION = os.getenv("SCOPE_INDEX_PRECISION", "float32")
+SCOPE_INDEX_RESCORE_FACTOR = int(os.getenv("SCOPE_INDEX_RESCORE_FACTOR", 4))
+SCOPE_INDEX_GET_BATCH = 5000
+DOT_BLOCK_ROWS = 4096
+PRECISIONS = ("float32", "float16", "int8")
+
+def distances_from_dots(dots, query_sq_norms, row_sq_norms, space: str):
+    # same distance definitions as Chroma's HNSW spaces
+    import numpy as np
+    if space == "l2":
+        return query_sq_norms[:, None] - 2 * dots + row_sq_norms[None, :]
+    if space == "cosine":
+        norms = np.sqrt(np.maximum(query_sq_norms, 1e-24))[:, None] * np.sqrt(np.maximum(row_sq_norms, 1e-24))[None, :]
+        return 1 - dots / norms
+    return 1 - dots
+
+class ScopeMatrix:
+    def __init__(self, pdf_ids, ids, metadatas, vectors, collections=None, rows=None, precision: str = "float32"):
+        import numpy as np
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown scope index precision: {precision}")
+        self.pdf_ids = frozenset(pdf_ids)
+        self.ids = ids
+        self.metadatas = metadatas
+        self.precision = precision
+        # where each row lives in Chroma, for full-precision rescoring
+        self.collections = collections or []
+        self.rows = rows
+        # norms come from the full-precision vectors so only the dot products are approximate
+        self.sq_norms = (vectors.astype(np.float32) ** 2).sum(1)
+        self.scales = None
+        if precision == "float16":
+            self.matrix = vectors.astype(np.float16)
+        elif precision == "int8":
+            self.scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32) / 127
+            self.matrix = np.round(vectors / self.scales[:, None]).astype(np.int8)
+        else:
+            self.matrix = vectors.astype(np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        extra = self.scales.nbytes if self.scales is not None else 0
+        return self.matrix.nbytes + self.sq_norms.nbytes + extra
+
+    def dots(self, queries):
+        import numpy as np
+        if self.precision == "float32":
+            return queries @ self.matrix.T
+        # widen block by block so the float32 copy never spans the whole matrix
+        dots = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), DOT_BLOCK_ROWS):
+            block = self.matrix[start:start + DOT_BLOCK_ROWS].astype(np.float32)
+            dots[:, start:start + DOT_BLOCK_ROWS] = queries @ block.T
+        if self.scales is not None:
+            dots *= self.scales[None, :]
+        return dots
+
+    def distances(self, queries, space: str):
+        return distances_from_dots(self.dots(queries), (queries ** 2).sum(1), self.sq_norms, space)
+
+class ScopeIndex:
+    # top-k over the chunks of one conversation scope, held in memory as a float32, float16
+    # or int8 matrix (SCOPE_INDEX_PRECISION). Only this cache is quantized: Chroma keeps its
+    # float32 vectors, and the candidates a quantized matrix picks are rescored from them, so
+    # float32 is exact and the others trade a little recall for memory. Anything not cached
+    # yet is answered by Chroma while a background job loads the matrix
+    def __init__(self, max_chunks: int = SCOPE_INDEX_MAX_CHUNKS, max_vectors: int = SCOPE_INDEX_MAX_VECTORS,
+                 precision: str = SCOPE_INDEX_PRECISION, rescore_factor: int = SCOPE_INDEX_RESCORE_FACTOR):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown scope index precision: {precision}")
+        self.max_chunks = max_chunks
+        self.max_vectors = max_vectors
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, ScopeMatrix]" = OrderedDict()
+        self._size = 0
+        self._building = set()
+        self._too_large = set()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(allowed_pdf_ids) -> tuple:
+        return tuple(sorted(set(allowed_pdf_ids)))
+
+    def search(self, store, embeddings, allowed_pdf_ids, n_results: int):
+        key = self.key(allowed_pdf_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                build = self.max_chunks and key not in self._building and key not in self._too_large
+                if build:
+                    self._building.add(key)
+                    generation = self._generation
+        if entry is None:
+            if build:
+                self._submit_build(store, key, generation)
+            return None
+        if not entry.ids:
+            return [[] for _ in embeddings]
+
+        import numpy as np
+        space = store.hnsw["space"]
+        queries = np.asarray(embeddings, dtype=np.float32)
+        distances = entry.distances(queries, space)
+        if entry.precision == "float32":
+            return [
+                [(float(row[i]), entry.metadatas[i]) for i in self.top_k(row, n_results)]
+                for row in distances
+            ]
+
+        # quantized scores only pick candidates; the final order uses float32 vectors from Chroma
+        candidates = [self.top_k(row, n_results * self.rescore_factor) for row in distances]
+        try:
+            vectors = self._fetch_vectors(entry, set(np.concatenate(candidates).tolist()))
+        except Exception:
+            vectors = {}
+        results = []
+        for query, row, rows in zip(queries, distances, candidates):
+            scored = {int(i): float(row[i]) for i in rows}
+            found = [i for i in scored if i in vectors]
+            if found:
+                dots = np.stack([vectors[i] for i in found]) @ query
+                exact = distances_from_dots(dots[None, :], np.asarray([query @ query]), entry.sq_norms[found], space)[0]
+                scored.update(zip(found, exact.tolist()))
+            ranked = sorted(scored.items(), key=lambda item: item[1])[:n_results]
+            results.append([(distance, entry.metadatas[i]) for i, distance in ranked])
+        return results
+
+    def _submit_build(self, store, key, generation):
+        # builds share the bounded job queue behind interactive work and ingests
+        from app.extensions import job_queue
+        from app.utils.job_queue import QueueFullError, PRIORITY_BACKGROUND
+        try:
+            job_queue.submit('scope_index', self._build, store, key, generation, priority=PRIORITY_BACKGROUND)
+        except QueueFullError:
+            # a later search for this scope tries again
+            with self._lock:
+                self._building.discard(key)
+
+    @staticmethod
+    def top_k(row, k: int):
+        import numpy as np
+        k = min(k, len(row))
+        top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+        return top[np.argsort(row[top])]
+
+    def _fetch_vectors(self, entry, rows) -> dict:
+        import numpy as np
+        by_collection = {}
+        for i in rows:
+            by_collection.setdefault(int(entry.rows[i]), []).append(i)
+        vectors = {}
+        for collection_index, indices in by_collection.items():
+            position = {entry.ids[i]: i for i in indices}
+            found = entry.collections[collection_index].get(ids=list(position), include=["embeddings"])
+            for chunk_id, vector in zip(found["ids"], found["embeddings"]):
+                vectors[position[chunk_id]] = np.asarray(vector, dtype=np.float32)
+        return vectors
+
+    def _load(self, store, key):
+        import numpy as np
+        from app.utils.embeddings import EmbeddingsUtils
+        ids, metadatas, vectors, seen = [], [], [], set()
+        collections, rows = [], []
+        for collection, pdf_ids in store.partitions_for(key):
+            collections.append(collection)
+            offset = 0
+            while True:
+                page = collection.get(
+                    where=EmbeddingsUtils.scope_filter(pdf_ids),
+                    include=["embeddings", "metadatas"],
+                    limit=SCOPE_INDEX_GET_BATCH,
+                    offset=offset
+                )
+                if len(page["ids"]) == 0:
+                    break
+                for chunk_id, metadata, vector in zip(page["ids"], page["metadatas"], page["embeddings"]):
+                    # a chunk shared by PDFs in different partitions is stored in each of them
+                    if chunk_id in seen:
+                        continue
+                    seen.add(chunk_id)
+                    ids.append(chunk_id)
+                    metadatas.append(metadata)
+                    vectors.append(vector)
+                    rows.append(len(collections) - 1)
+                if len(ids) > self.max_chunks:
+                    return None
+                offset += len(page["ids"])
+        return ScopeMatrix(
+            key, ids, metadatas, np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1),
+            collections, np.asarray(rows, dtype=np.int16), self.precision
+        )
+
+    def _build(self, store, key, generation):
+        try:
+            entry = self._load(store, key)
+        except Exception:
+            entry = None
+            failed = True
+        else:
+            failed = False
+
+        with self._lock:
+            self._building.discard(key)
+            if entry is None:
+                if not failed:
+                    self._too_large.add(key)
+                return
+            # an ingest or delete landed while loading; the matrix may be stale
+            if generation != self._generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.ids)
+            self._entries[key] = entry
+            self._size += len(entry.ids)
+            while self._size > self.max_vectors and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.ids)
+
+    def invalidate_pdf(self, pdf_id: str):
+        pdf_id = str(pdf_id)
+        with self._lock:
+            self._generation += 1
+            for key in [key for key, entry in self._entries.items() if pdf_id in entry.pdf_ids]:
+                self._size -= len(self._entries.pop(key).ids)
+            self._too_large = {key for key in self._too_large if pdf_id not in key}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "scopes": len(self._entries),
+                "vectors": self._size,
+                "bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "precision": self.precision,
+                "max_vectors": self.max_vectors,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
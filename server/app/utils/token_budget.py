@@ -0,0 +1,109 @@
+import os
+import threading
+
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "gemini-2.0-flash": 1048576,
+    "deepseek-chat": 65536
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+LLM_RESPONSE_TOKENS = int(os.getenv("LLM_RESPONSE_TOKENS", 1024))
+# 0 leaves the prompt bounded by the model window only
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", 0))
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", 0.25))
+PROMPT_HISTORY_MAX_TOKENS = int(os.getenv("PROMPT_HISTORY_MAX_TOKENS", 4000))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+MESSAGE_OVERHEAD_TOKENS = 4
+MIN_TRUNCATED_CHUNK_TOKENS = 64
+CHARS_PER_TOKEN = 4
+
+class TokenBudget:
+    # counts with tiktoken when it is installed and its encoding loads, otherwise by characters
+    _lock = threading.Lock()
+    _encoding = None
+    _loaded = False
+
+    @staticmethod
+    def encoding():
+        if not TokenBudget._loaded:
+            with TokenBudget._lock:
+                if not TokenBudget._loaded:
+                    try:
+                        import tiktoken
+                        TokenBudget._encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                    except Exception:
+                        TokenBudget._encoding = None
+                    TokenBudget._loaded = True
+        return TokenBudget._encoding
+
+    @staticmethod
+    def count(text: str) -> int:
+        if not text:
+            return 0
+        encoding = TokenBudget.encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return max(1, len(text) // CHARS_PER_TOKEN)
+
+    @staticmethod
+    def truncate(text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        encoding = TokenBudget.encoding()
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+    @staticmethod
+    def message_tokens(message: dict) -> int:
+        return TokenBudget.count(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def prompt_limit(model_name: str) -> int:
+        # what the prompt may use once the reply has its share of the window
+        limit = MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW) - LLM_RESPONSE_TOKENS
+        if PROMPT_MAX_TOKENS:
+            limit = min(limit, PROMPT_MAX_TOKENS)
+        return limit
+
+    @staticmethod
+    def allocate(available: int, history_need: int, context_need: int) -> tuple[int, int]:
+        # history is guaranteed its share (up to its cap); whatever either side leaves unused goes to the other
+        available = max(available, 0)
+        history_cap = min(history_need, PROMPT_HISTORY_MAX_TOKENS)
+        history = min(history_cap, max(int(available * PROMPT_HISTORY_SHARE), available - context_need))
+        return history, available - history
+
+    @staticmethod
+    def trim_history(messages: list[dict], budget: int) -> list[dict]:
+        # newest turns first; stops at the first turn that does not fit so the kept history stays contiguous
+        kept, used = [], 0
+        for message in reversed(messages):
+            tokens = TokenBudget.message_tokens(message)
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        # a reply without its question only confuses the model
+        while kept and kept[0].get("role") == "assistant":
+            kept.pop(0)
+        return kept
+
+    @staticmethod
+    def trim_context(chunks: list[str], budget: int) -> list[str]:
+        # chunks arrive best first (or in page order for full PDFs); the first one that
+        # overflows is cut short if enough room is left, everything after it is dropped
+        kept, used = [], 0
+        for chunk in chunks:
+            tokens = TokenBudget.count(chunk) + 2
+            if used + tokens <= budget:
+                kept.append(chunk)
+                used += tokens
+                continue
+            remaining = budget - used - 2
+            if remaining >= MIN_TRUNCATED_CHUNK_TOKENS:
+                kept.append(TokenBudget.truncate(chunk, remaining))
+            break
+        return kept
@@ -0,0 +1,55 @@
+import os
+import hashlib
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+class HashingFile:
+    # werkzeug writes each uploaded file part straight into this temp file in uploads/,
+    # so the body is hashed and size-checked while it is parsed and lands on disk once
+    def __init__(self, folder: str, max_bytes: int = None):
+        fd, self.path = tempfile.mkstemp(suffix='.part', dir=folder)
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self._sha.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
+
+    def claim(self, destination: str):
+        self._file.close()
+        os.replace(self.path, destination)
+        self.path = None
+
+    def discard(self):
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        folder = os.path.join(current_app.root_path, '..', 'uploads')
+        os.makedirs(folder, exist_ok=True)
+        stream = HashingFile(folder, current_app.config.get("MAX_UPLOAD_BYTES"))
+        self.__dict__.setdefault("_upload_files", []).append(stream)
+        return stream
+
+    def close(self):
+        # parts the view did not claim (rejected, duplicate, aborted mid-parse) are removed
+        try:
+            super().close()
+        finally:
+            for stream in self.__dict__.get("_upload_files", []):
+                stream.discard()
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+from collections import defaultdict
+from app.utils.embedding_backends import collection_name
+from app.utils.scope_index import ScopeIndex
+
+# the old fixed cut-off was 1.5 in squared L2; on unit vectors that is cosine similarity
+# 0.25, i.e. a cosine or inner-product distance of 0.75
+MAX_DISTANCE_BY_SPACE = {"l2": 1.5, "cosine": 0.75, "ip": 0.75}
+
+class ChromaStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._collections = {}
+        self.path = "./chroma_store"
+        self.collection_name = collection_name()
+        self.partitions = 1
+        self.hnsw = {"space": "l2", "max_neighbors": 16, "ef_construction": 100, "ef_search": 100}
+        self.max_distance_override = None
+        self.scope_index = ScopeIndex()
+
+    def init_app(self, app):
+        self.path = app.config.get("CHROMA_PATH", self.path)
+        self.collection_name = app.config.get("CHROMA_COLLECTION", self.collection_name)
+        self.partitions = max(int(app.config.get("CHROMA_PARTITIONS", self.partitions)), 1)
+        self.hnsw = {
+            "space": app.config.get("CHROMA_HNSW_SPACE", self.hnsw["space"]),
+            "max_neighbors": int(app.config.get("CHROMA_HNSW_M", self.hnsw["max_neighbors"])),
+            "ef_construction": int(app.config.get("CHROMA_HNSW_CONSTRUCTION_EF", self.hnsw["ef_construction"])),
+            "ef_search": int(app.config.get("CHROMA_HNSW_SEARCH_EF", self.hnsw["ef_search"])),
+        }
+        if self.hnsw["space"] not in MAX_DISTANCE_BY_SPACE:
+            raise ValueError(f"Unknown HNSW space: {self.hnsw['space']}")
+        self.max_distance_override = app.config.get("RETRIEVAL_MAX_DISTANCE")
+
+    @property
+    def max_distance(self) -> float:
+        if self.max_distance_override is not None:
+            return float(self.max_distance_override)
+        return MAX_DISTANCE_BY_SPACE[self.hnsw["space"]]
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import chromadb
+                    self._client = chromadb.PersistentClient(path=self.path)
+        return self._client
+
+    def bucket(self, pdf_id: str) -> int:
+        # stable across processes, unlike hash()
+        digest = hashlib.sha1(str(pdf_id).encode("utf-8")).hexdigest()
+        return int(digest[:8], 16) % self.partitions
+
+    def bucket_name(self, bucket: int) -> str:
+        # a single partition keeps the original collection so unpartitioned stores still load
+        if self.partitions == 1:
+            return self.collection_name
+        return f"{self.collection_name}_p{bucket:03d}"
+
+    def _collection(self, bucket: int):
+        collection = self._collections.get(bucket)
+        if collection is None:
+            client = self.client
+            with self._lock:
+                collection = self._collections.get(bucket)
+                if collection is None:
+                    # vectors come from the configured embedding backend; Chroma only stores them
+                    collection = client.get_or_create_collection(
+                        name=self.bucket_name(bucket),
+                        configuration={"hnsw": dict(self.hnsw)}
+                    )
+                    self._adopt_configuration(collection)
+                    self._collections[bucket] = collection
+        return collection
+
+    def _adopt_configuration(self, collection):
+        # space, M and construction_ef are fixed when a collection is created; only
+        # search_ef can be changed on an existing one
+        current = (collection.configuration or {}).get("hnsw") or {}
+        if current.get("space"):
+            self.hnsw["space"] = current["space"]
+        if current.get("ef_search") not in (None, self.hnsw["ef_search"]):
+            collection.modify(configuration={"hnsw": {"ef_search": self.hnsw["ef_search"]}})
+
+    def partition(self, pdf_id: str):
+        return self._collection(self.bucket(pdf_id))
+
+    def partitions_for(self, pdf_ids) -> list:
+        groups = defaultdict(list)
+        for pdf_id in pdf_ids:
+            groups[self.bucket(pdf_id)].append(pdf_id)
+        return [(self._collection(bucket), ids) for bucket, ids in sorted(groups.items())]
+
+    def all_partitions(self) -> list:
+        return [self._collection(bucket) for bucket in range(self.partitions)]
@@ -1,6 +1,10 @@
 from app import create_app
 
-app = create_app()
+# PDF extraction workers are spawned processes that re-import this module as __mp_main__;
+# building the app there would start job queue threads and a Mongo client in every worker,
+# so anything with side effects here has to stay behind this check
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,93 @@
+# Measures embedding throughput for each backend/model/precision combination.
+# Run from the server directory:
+#   python test/bench_embeddings.py [--pdf some.pdf] [--chunks 512] [--batch-sizes 16,32,64] [--threads 0,4]
+#                                   [--only onnx:all-MiniLM-L6-v2:int8,...]
+# A combination that cannot load (missing dependency or model file) is reported as FAILED
+# and the script exits non-zero; use --only to bench just the installed backends.
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.embedding_backends import create_backend
+
+COMBINATIONS = [
+    ("chroma-default", "all-MiniLM-L6-v2", "fp32"),
+    ("sentence-transformers", "all-MiniLM-L6-v2", "fp32"),
+    ("sentence-transformers", "all-MiniLM-L6-v2", "int8"),
+    ("onnx", "all-MiniLM-L6-v2", "fp32"),
+    ("onnx", "all-MiniLM-L6-v2", "int8"),
+    ("sentence-transformers", "all-mpnet-base-v2", "fp32"),
+    ("sentence-transformers", "all-mpnet-base-v2", "int8"),
+    ("onnx", "all-mpnet-base-v2", "fp32"),
+    ("onnx", "all-mpnet-base-v2", "int8"),
+]
+
+SAMPLE = (
+    "The quarterly report summarises revenue growth across regions, highlights the impact of "
+    "supply chain delays on margins, and outlines the hiring plan for the engineering teams. "
+)
+
+def load_chunks(pdf_path, count):
+    if pdf_path:
+        from app.utils.pdf_preprocess import PDFUtils
+        chunks = []
+        for page in PDFUtils.iter_information(pdf_path):
+            chunks.extend(page["text"][start:end] for start, end in page["spans"])
+            if len(chunks) >= count:
+                break
+        return chunks[:count]
+    # ~1000 characters, the same size the ingest splitter produces
+    return [f"{i} " + SAMPLE * 6 for i in range(count)]
+
+def bench(backend, chunks, repeats):
+    backend.embed(chunks[:backend.batch_size])
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.embed(chunks)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf")
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--batch-sizes", default="32")
+    parser.add_argument("--threads", default="0")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", help="comma-separated backend:model:precision combinations")
+    args = parser.parse_args()
+
+    combinations = COMBINATIONS
+    if args.only:
+        combinations = [tuple(item.split(":")) for item in args.only.split(",")]
+
+    chunks = load_chunks(args.pdf, args.chunks)
+    characters = sum(len(chunk) for chunk in chunks)
+    print(f"{len(chunks)} chunks, {characters} characters\n")
+    print(f"{'backend':<22} {'model':<18} {'prec':<5} {'batch':>5} {'thr':>4} {'chunks/s':>10} {'chars/s':>11}")
+
+    failures = 0
+    for name, model, precision in combinations:
+        for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+            for threads in [int(t) for t in args.threads.split(",")]:
+                label = f"{name:<22} {model:<18} {precision:<5} {batch_size:>5} {threads:>4}"
+                try:
+                    backend = create_backend(name, model, precision, batch_size, threads)
+                    seconds = bench(backend, chunks, args.repeats)
+                except Exception as e:
+                    failures += 1
+                    print(f"{label}  FAILED: {type(e).__name__}: {e}")
+                    continue
+                print(f"{label} {len(chunks) / seconds:>10.1f} {characters / seconds:>11.0f}")
+
+    if failures:
+        print(f"\n{failures} combination(s) failed to load or run")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
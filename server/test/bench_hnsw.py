@@ -0,0 +1,110 @@
+# Builds the chunk index under several HNSW settings and reports recall@k against brute
+# force together with p50/p99 query latency.
+# Run from the server directory:
+#   python test/bench_hnsw.py [--chroma-path ./chroma_store] [--spaces l2,cosine] [--m 16,32]
+#                             [--construction-ef 100,200] [--search-ef 10,50,100,200]
+# With --chroma-path the vectors of the existing corpus are used, otherwise a synthetic
+# clustered set of --synthetic vectors.
+
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import chromadb
+
+ADD_BATCH = 4096
+
+def load_corpus(chroma_path):
+    client = chromadb.PersistentClient(path=chroma_path)
+    vectors = []
+    for collection in client.list_collections():
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings"], limit=ADD_BATCH, offset=offset)
+            if len(page["ids"]) == 0:
+                break
+            vectors.extend(page["embeddings"])
+            offset += len(page["ids"])
+    return np.asarray(vectors, dtype=np.float32)
+
+def synthetic_corpus(count, dimensions, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(count // 50, 1), dimensions))
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.3 * rng.normal(size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def brute_force(corpus, queries, space, k):
+    if space == "l2":
+        distances = (queries ** 2).sum(1)[:, None] - 2 * queries @ corpus.T + (corpus ** 2).sum(1)[None, :]
+    elif space == "cosine":
+        normalized = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        distances = 1 - (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    else:
+        distances = 1 - queries @ corpus.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+def build(client, corpus, space, m, construction_ef, search_ef):
+    collection = client.create_collection(
+        name=f"bench_{space}_{m}_{construction_ef}_{search_ef}",
+        configuration={"hnsw": {
+            "space": space,
+            "max_neighbors": m,
+            "ef_construction": construction_ef,
+            "ef_search": search_ef
+        }}
+    )
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), ADD_BATCH):
+        batch = corpus[offset:offset + ADD_BATCH]
+        collection.add(ids=[str(i) for i in range(offset, offset + len(batch))], embeddings=batch)
+    return collection, time.perf_counter() - start
+
+def measure(collection, queries, truth, k):
+    timings, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query], n_results=k, include=[])
+        timings.append(time.perf_counter() - start)
+        hits += len(set(int(i) for i in result["ids"][0]) & set(expected.tolist()))
+    return hits / truth.size, np.percentile(timings, 50), np.percentile(timings, 99)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma-path")
+    parser.add_argument("--synthetic", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--spaces", default="l2,cosine")
+    parser.add_argument("--m", default="16,32")
+    parser.add_argument("--construction-ef", default="100,200")
+    parser.add_argument("--search-ef", default="10,50,100,200")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.chroma_path) if args.chroma_path else synthetic_corpus(args.synthetic, args.dimensions, 0)
+    if len(corpus) <= args.queries:
+        print(f"corpus too small: {len(corpus)} vectors")
+        sys.exit(1)
+    rng = np.random.default_rng(1)
+    # held-out corpus vectors with a little noise stand in for user queries
+    picked = rng.choice(len(corpus), size=args.queries, replace=False)
+    queries = corpus[picked] + 0.05 * rng.normal(size=corpus[picked].shape).astype(np.float32)
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {args.queries} queries, recall@{args.k}\n")
+    print(f"{'space':<7} {'M':>4} {'c_ef':>5} {'s_ef':>5} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8}")
+
+    for space in args.spaces.split(","):
+        truth = brute_force(corpus, queries, space, args.k)
+        for m in [int(v) for v in args.m.split(",")]:
+            for construction_ef in [int(v) for v in args.construction_ef.split(",")]:
+                for search_ef in [int(v) for v in args.search_ef.split(",")]:
+                    with tempfile.TemporaryDirectory() as path:
+                        client = chromadb.PersistentClient(path=path)
+                        collection, build_seconds = build(client, corpus, space, m, construction_ef, search_ef)
+                        recall, p50, p99 = measure(collection, queries, truth, args.k)
+                    print(f"{space:<7} {m:>4} {construction_ef:>5} {search_ef:>5} {build_seconds:>8.1f} "
+                          f"{recall:>7.3f} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f}")
+
+if __name__ == "__main__":
+    main()
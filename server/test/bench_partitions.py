@@ -0,0 +1,77 @@
+# Compares scoped query latency on a single collection against hash-bucketed partitions
+# as the corpus grows. Uses random vectors so no embedding model is needed.
+# Run from the server directory:
+#   python test/bench_partitions.py [--corpus 100,1000,5000] [--partitions 16] [--scope 3]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.vector_store import ChromaStore
+from app.utils.embeddings import EmbeddingsUtils
+
+DIMENSIONS = 384
+
+class Config:
+    def __init__(self, path, partitions):
+        self.config = {"CHROMA_PATH": path, "CHROMA_PARTITIONS": partitions}
+
+def random_vector(rng):
+    return [rng.uniform(-1, 1) for _ in range(DIMENSIONS)]
+
+def build_store(path, partitions, pdf_count, chunks_per_pdf, seed):
+    rng = random.Random(seed)
+    store = ChromaStore()
+    store.init_app(Config(path, partitions))
+    for pdf_index in range(pdf_count):
+        pdf_id = f"pdf{pdf_index:06d}"
+        collection = store.partition(pdf_id)
+        collection.add(
+            ids=[f"{pdf_id}-{i}" for i in range(chunks_per_pdf)],
+            embeddings=[random_vector(rng) for _ in range(chunks_per_pdf)],
+            metadatas=[
+                EmbeddingsUtils._add_ref({}, pdf_id, "bench", 1, 0, 0)
+                for _ in range(chunks_per_pdf)
+            ]
+        )
+    return store
+
+def time_queries(store, pdf_count, scope, queries, seed):
+    rng = random.Random(seed)
+    store.all_partitions()
+    timings = []
+    for _ in range(queries):
+        allowed = [f"pdf{rng.randrange(pdf_count):06d}" for _ in range(scope)]
+        embedding = random_vector(rng)
+        start = time.perf_counter()
+        EmbeddingsUtils.query_partitions(store, embedding, allowed, n_results=5)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="100,1000,5000")
+    parser.add_argument("--chunks-per-pdf", type=int, default=20)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--scope", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'pdfs':>6} {'chunks':>8} {'partitions':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for pdf_count in [int(c) for c in args.corpus.split(",")]:
+        for partitions in sorted({1, args.partitions}):
+            with tempfile.TemporaryDirectory() as path:
+                store = build_store(path, partitions, pdf_count, args.chunks_per_pdf, seed=pdf_count)
+                p50, p95 = time_queries(store, pdf_count, args.scope, args.queries, seed=pdf_count + 1)
+                print(f"{pdf_count:>6} {pdf_count * args.chunks_per_pdf:>8} {partitions:>10} "
+                      f"{p50 * 1000:>8.2f} {p95 * 1000:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Compares memory footprint and recall of the scope index at float32, float16 and int8,
+# with and without full-precision rescoring of the top candidates.
+# Run from the server directory:
+#   python test/bench_quantization.py [--chroma-path ./chroma_store] [--k 5] [--rescore-factor 4]
+# With --chroma-path the stored chunk vectors are sampled, otherwise a synthetic clustered set.
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import chromadb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.scope_index import ScopeMatrix, ScopeIndex, PRECISIONS, distances_from_dots
+
+def load_corpus(chroma_path, limit):
+    client = chromadb.PersistentClient(path=chroma_path)
+    vectors = []
+    for collection in client.list_collections():
+        page = collection.get(include=["embeddings"], limit=limit - len(vectors))
+        vectors.extend(page["embeddings"])
+        if len(vectors) >= limit:
+            break
+    return np.asarray(vectors, dtype=np.float32)
+
+def synthetic_corpus(count, dimensions, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(count // 50, 1), dimensions))
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.3 * rng.normal(size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def recall(found, truth):
+    return np.mean([len(set(f.tolist()) & set(t.tolist())) / len(t) for f, t in zip(found, truth)])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma-path")
+    parser.add_argument("--sample", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--space", default="l2")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.chroma_path, args.sample) if args.chroma_path else synthetic_corpus(args.sample, args.dimensions, 0)
+    rng = np.random.default_rng(1)
+    picked = rng.choice(len(corpus), size=min(args.queries, len(corpus)), replace=False)
+    queries = corpus[picked] + 0.05 * rng.normal(size=corpus[picked].shape).astype(np.float32)
+    ids = [str(i) for i in range(len(corpus))]
+
+    exact = ScopeMatrix([], ids, [None] * len(ids), corpus)
+    truth = [ScopeIndex.top_k(row, args.k) for row in exact.distances(queries, args.space)]
+    query_sq_norms = (queries ** 2).sum(1)
+
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, {args.space}, recall@{args.k}\n")
+    print(f"{'precision':<9} {'bytes':>12} {'saved':>7} {'recall':>7} {'rescored':>9}")
+    for precision in PRECISIONS:
+        matrix = ScopeMatrix([], ids, [None] * len(ids), corpus, precision=precision)
+        approx = matrix.distances(queries, args.space)
+        plain = [ScopeIndex.top_k(row, args.k) for row in approx]
+
+        rescored = []
+        for query, query_sq_norm, row in zip(queries, query_sq_norms, approx):
+            candidates = ScopeIndex.top_k(row, args.k * args.rescore_factor)
+            distances = distances_from_dots(
+                (corpus[candidates] @ query)[None, :], np.asarray([query_sq_norm]), matrix.sq_norms[candidates], args.space
+            )[0]
+            rescored.append(candidates[np.argsort(distances)[:args.k]])
+
+        saved = 1 - matrix.nbytes / exact.nbytes
+        print(f"{precision:<9} {matrix.nbytes:>12} {saved:>7.1%} {recall(plain, truth):>7.3f} {recall(rescored, truth):>9.3f}")
+
+if __name__ == "__main__":
+    main()
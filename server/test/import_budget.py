@@ -0,0 +1,69 @@
+# Reports where `from app import create_app; create_app()` spends its import time.
+# Run from the server directory:
+#   python test/import_budget.py [--budget 1.0] [--top 25]
+# Exits non-zero when create_app() takes longer than the budget (seconds).
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(f"CREATE_APP_SECONDS={time.perf_counter() - start:.4f}")
+"""
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def run_probe():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=SERVER_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-4000:])
+        sys.exit(result.returncode)
+    seconds = float(re.search(r"CREATE_APP_SECONDS=([\d.]+)", result.stdout).group(1))
+    return seconds, result.stderr.splitlines()
+
+def parse_imports(lines):
+    imports = []
+    for line in lines:
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        depth = (len(indent) - 1) // 2
+        imports.append((int(cumulative_us), int(self_us), depth, module))
+    return sorted(imports, reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=1.0)
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    seconds, lines = run_probe()
+    imports = parse_imports(lines)
+
+    print(f"{'cumulative ms':>14} {'self ms':>9} {'depth':>6}  module")
+    for cumulative_us, self_us, depth, module in imports[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f} {depth:>6}  {module}")
+    total_ms = sum(cumulative_us for cumulative_us, _, depth, _ in imports if depth == 0) / 1000
+    print(f"\ntop-level imports: {total_ms:.1f} ms")
+    print(f"create_app(): {seconds:.3f} s (budget {args.budget:.3f} s)")
+
+    if seconds > args.budget:
+        print("OVER BUDGET")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()